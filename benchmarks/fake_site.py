@@ -0,0 +1,121 @@
+"""
+A local aiohttp server producing a synthetic website, so crawls can be benchmarked and tested offline.
+
+Usage: python -m benchmarks.fake_site [--port 8900] [--pages 1000] [--fanout 10] ...
+"""
+import argparse
+import asyncio
+import multiprocessing
+import random
+import socket
+import time
+
+from aiohttp import web
+
+FILLER = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt. '
+
+
+class FakeSite:
+    """
+    Synthetic website with `pages` pages, each linking to `fanout` other pages.
+    Page `0` is served at `/`, every other page at `/page/<n>`.
+    """
+
+    def __init__(self, pages: int = 1000, fanout: int = 10, page_kb: float = 20.0,
+                 latency_ms: float = 20.0, latency_sigma: float = 0.5, error_rate: float = 0.0, seed: int = 42):
+        """
+        Arguments:
+            pages: number of distinct pages
+            fanout: number of links per page
+            page_kb: approximate size of each page in KB
+            latency_ms: median response latency, latencies are log-normally distributed
+            latency_sigma: spread of the latency distribution (0 for a fixed latency)
+            error_rate: share of requests answered with `503 Service Unavailable`
+            seed: seed for latencies and errors
+        """
+        self.pages = pages
+        self.fanout = fanout
+        self.page_kb = page_kb
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._filler = FILLER * max(1, int(page_kb * 1024 / len(FILLER)))
+
+    def url(self, index: int):
+        return '/' if index == 0 else f'/page/{index}'
+
+    def render(self, index: int):
+        links = ''.join(
+            f'<li><a href="{self.url((index * self.fanout + k + 1) % self.pages)}">Page {k}</a></li>'
+            for k in range(self.fanout)
+        )
+        return (
+            f'<!DOCTYPE html><html><head><title>Page {index}</title></head><body>'
+            f'<h1>Page {index}</h1><ul>{links}</ul><p>{self._filler}</p></body></html>'
+        )
+
+    async def handle(self, request: web.Request):
+        index = int(request.match_info.get('index', 0))
+        if index >= self.pages:
+            raise web.HTTPNotFound()
+        if self.latency_ms:
+            latency = self.latency_ms / 1000
+            if self.latency_sigma:
+                latency = self._random.lognormvariate(0, self.latency_sigma) * latency
+            await asyncio.sleep(latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            return web.Response(status=503, text='Service Unavailable')
+        return web.Response(text=self.render(index), content_type='text/html')
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/', self.handle)
+        app.router.add_get('/page/{index}', self.handle)
+        return app
+
+    def serve(self, port: int, host: str = '127.0.0.1'):
+        """ Serves the site, blocking until interrupted """
+        web.run_app(self.app(), host=host, port=port, print=None, access_log=None)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_in_process(site: FakeSite, port: int = None):
+    """
+    Serves the site in a separate process, so it does not share CPU time or memory with the crawler.
+    Returns the process and the URL of the site.
+    """
+    port = port or free_port()
+    process = multiprocessing.Process(target=site.serve, args=(port,), daemon=True)
+    process.start()
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                break
+        time.sleep(0.05)
+    return process, f'http://127.0.0.1:{port}/'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--page-kb', type=float, default=20.0)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    site = FakeSite(args.pages, args.fanout, args.page_kb, args.latency_ms, args.latency_sigma, args.error_rate)
+    print(f'Serving {args.pages} pages on http://127.0.0.1:{args.port}/')
+    site.serve(args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Runs Microwler against a local synthetic website and reports throughput, fetch latency,
+peak memory and CPU time as JSON, so results can be compared between versions.
+
+Usage: python -m benchmarks.harness [--pages 1000] [--fanout 10] [--concurrency 20] [--output results.json]
+"""
+import argparse
+import contextlib
+import json
+import platform
+import resource
+import sys
+import time
+
+from benchmarks.fake_site import FakeSite, start_in_process
+from microwler import Microwler, scrape
+
+
+class TimedMicrowler(Microwler):
+    """ Records the duration of every fetch """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    async def _get(self, url, validators: dict = None):
+        start = time.perf_counter()
+        try:
+            return await super()._get(url, validators)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+def percentile(values: list, share: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run(site: FakeSite, settings: dict, select: bool = False, keep_source: bool = False):
+    process, url = start_in_process(site)
+    try:
+        selectors = {'title': scrape.title, 'headings': scrape.headings} if select else None
+        crawler = TimedMicrowler(url, select=selectors, settings=settings)
+        cpu_start, start = time.process_time(), time.perf_counter()
+        with contextlib.redirect_stdout(sys.stderr):
+            crawler.run(keep_source=keep_source)
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    finally:
+        process.terminate()
+        process.join()
+
+    pages = len(crawler.results)
+    return {
+        'pages': pages,
+        'errors': len(crawler.errors),
+        'seconds': round(elapsed, 3),
+        'pages_per_second': round(pages / elapsed, 1) if elapsed else None,
+        'fetch_latency_p50_ms': round(percentile(crawler.latencies, 0.5) * 1000, 1) if pages else None,
+        'fetch_latency_p99_ms': round(percentile(crawler.latencies, 0.99) * 1000, 1) if pages else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'cpu_ms_per_page': round(cpu * 1000 / pages, 3) if pages else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--page-kb', type=float, default=20.0)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--max-depth', type=int, default=10)
+    parser.add_argument('--select', action='store_true', help='scrape title and headings of every page')
+    parser.add_argument('--settings', type=json.loads, default={}, help='additional crawler settings as JSON')
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    args = parser.parse_args()
+
+    site = FakeSite(args.pages, args.fanout, args.page_kb, args.latency_ms, args.latency_sigma, args.error_rate)
+    settings = {'max_concurrency': args.concurrency, 'max_depth': args.max_depth, **args.settings}
+    report = {
+        'python': platform.python_version(),
+        'site': {key: value for key, value in vars(args).items() if key not in ('settings', 'output')},
+        'settings': settings,
+        'results': run(site, settings, select=args.select),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Measures the cold-start import time of every CLI subcommand in fresh interpreters and checks that
+subcommands don't import heavy dependencies they don't need. Exits with 1 if one of them does.
+
+Usage: python -m benchmarks.import_time [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY = ('aiohttp', 'quart', 'quart_cors', 'lxml', 'parsel', 'diskcache', 'pyarrow', 'random_user_agent',
+         'prettytable', 'completely', 'html_text')
+# modules imported by each subcommand (a project generated from the template imports `scrape` and `export`)
+PROJECT = ['microwler.crawler', 'microwler.scrape', 'microwler.export']
+COMMANDS = {
+    'microwler': (['microwler.cli.cmd'], HEAVY),
+    'new': (['microwler.cli.cmd', 'microwler.cli.template'], HEAVY),
+    'crawler run': (['microwler.cli.cmd'] + PROJECT, ('quart', 'quart_cors', 'pyarrow', 'diskcache')),
+    'crawler dumpcache': (['microwler.cli.cmd', 'microwler.cache'] + PROJECT, ('quart', 'quart_cors', 'pyarrow')),
+    'crawl-all': (['microwler.cli.cmd', 'microwler.orchestrator'], ('quart', 'quart_cors', 'pyarrow', 'parsel')),
+    'serve': (['microwler.cli.cmd', 'microwler.web.backend'], ('pyarrow',)),
+}
+SCRIPT = '''
+import sys, time, json
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+print(json.dumps([time.perf_counter() - start, sorted(m for m in {heavy!r} if m in sys.modules)]))
+'''
+
+
+def measure(modules: list, heavy=HEAVY):
+    """ Imports the modules in a fresh interpreter, returns the time in seconds and the heavy modules loaded """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    output = subprocess.run(
+        [sys.executable, '-c', SCRIPT.format(modules=modules, heavy=heavy)],
+        env=env, cwd=root, check=True, capture_output=True, text=True,
+    ).stdout
+    seconds, loaded = json.loads(output.splitlines()[-1])
+    return seconds, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results, failed = [], False
+    for command, (modules, forbidden) in COMMANDS.items():
+        timings, loaded = [], []
+        for _ in range(args.runs):
+            seconds, loaded = measure(modules)
+            timings.append(seconds)
+        unexpected = sorted(set(loaded) & set(forbidden))
+        failed = failed or bool(unexpected)
+        results.append({
+            'command': command,
+            'median_ms': round(statistics.median(timings) * 1000, 1),
+            'heavy_modules': loaded,
+            'unexpected': unexpected,
+        })
+    print(json.dumps(results, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
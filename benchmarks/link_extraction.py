@@ -0,0 +1,70 @@
+"""
+Measures how link extraction throughput (pages/s) scales with the size of the parser pool.
+
+Usage: python -m benchmarks.link_extraction [--pages 2000] [--links 500]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from microwler.utils import extract_links
+
+BASE_URL = 'https://example.com/'
+LINK_FILTER = '//a/@href'
+
+
+def make_page(index: int, links: int):
+    anchors = ''.join(f'<li><a href="/page/{index}/{i}">Link {i}</a><p>{"lorem ipsum " * 10}</p></li>'
+                      for i in range(links))
+    return f'<html><head><title>Page {index}</title></head><body><ul>{anchors}</ul></body></html>'
+
+
+async def run(pages, executor):
+    loop = asyncio.get_event_loop()
+    if executor is None:
+        return [extract_links(page, BASE_URL, LINK_FILTER) for page in pages]
+    futures = [loop.run_in_executor(executor, extract_links, page, BASE_URL, LINK_FILTER) for page in pages]
+    return await asyncio.gather(*futures)
+
+
+def measure(pages, kind, workers):
+    executor = None
+    if kind == 'process':
+        executor = ProcessPoolExecutor(max_workers=workers)
+    elif kind == 'thread':
+        executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        if executor is not None:
+            # warm up the pool so that worker startup is not measured
+            asyncio.run(run(pages[:workers * 2], executor))
+        start = time.perf_counter()
+        asyncio.run(run(pages, executor))
+        elapsed = time.perf_counter() - start
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return {'pool': kind, 'workers': workers, 'seconds': round(elapsed, 3), 'pages_per_second': round(len(pages) / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--links', type=int, default=500)
+    args = parser.parse_args()
+
+    pages = [make_page(i, args.links) for i in range(args.pages)]
+    cores = os.cpu_count() or 1
+    counts = sorted({1, 2, 4, cores} | {c for c in (8, 16) if c <= cores})
+
+    results = [measure(pages, None, 0)]
+    for kind in ('thread', 'process'):
+        for workers in counts:
+            results.append(measure(pages, kind, workers))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Compares the URL filter engine with the previous per-link normalization and extension checks.
+Links are generated like on a real site: most of them are navigation and footer links shared by all pages.
+
+Usage: python -m benchmarks.urlfilter [--pages 2000] [--links 200] [--shared 0.8]
+"""
+import argparse
+import json
+import random
+import time
+
+from microwler.urlfilter import IGNORED_EXTENSIONS, URLFilter
+from microwler.utils import norm_url
+
+BASE_URL = 'https://example.com/'
+
+
+def make_links(pages: int, links: int, shared: float):
+    """ Returns the links of every page, a share of which recur on all pages """
+    rng = random.Random(0)
+    nav = [f'{BASE_URL}section/{i}?utm_source=nav&page={i % 7}' for i in range(int(links * shared))]
+    nav += [f'{BASE_URL}static/logo{i}.png' for i in range(5)]
+    result = []
+    for page in range(pages):
+        own = [f'{BASE_URL}article/{page}/{i}?ref={rng.randint(0, 9)}#comments'
+               for i in range(links - len(nav))]
+        result.append(nav + own)
+    return result
+
+
+def legacy(pages):
+    for links in pages:
+        for link in links:
+            if not any([link.lower().endswith(e) for e in IGNORED_EXTENSIONS]):
+                norm_url(link)
+
+
+def engine(pages, url_filter):
+    for links in pages:
+        for link in url_filter.filter(links):
+            url_filter.normalize(link)
+
+
+def measure(name, function, *args):
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    links = sum(len(links) for links in args[0])
+    return {'variant': name, 'seconds': round(elapsed, 3), 'links_per_second': round(links / elapsed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--links', type=int, default=200)
+    parser.add_argument('--shared', type=float, default=0.8, help='share of links which recur on every page')
+    args = parser.parse_args()
+
+    pages = make_links(args.pages, args.links, args.shared)
+    strip_params = ['utm_*', 'gclid', 'fbclid']
+    results = [
+        measure('legacy', legacy, pages),
+        measure('filter (no cache)', engine, pages, URLFilter(strip_params=strip_params, cache_size=0)),
+        measure('filter', engine, pages, URLFilter(strip_params=strip_params)),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -24,8 +24,6 @@ SOFTWARE.
 
 import os
 
-from microwler.crawler import Microwler
-
 import logging
 
 from microwler.utils import PROJECT_FOLDER
@@ -33,3 +31,18 @@ from microwler.utils import PROJECT_FOLDER
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(asctime)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
 os.makedirs(PROJECT_FOLDER, exist_ok=True)
+
+__all__ = ['Microwler']
+
+
+def __getattr__(name):
+    # the crawler pulls in aiohttp, lxml and friends, so it is only imported when it is used (PEP 562)
+    if name == 'Microwler':
+        from microwler.crawler import Microwler
+        globals()['Microwler'] = Microwler
+        return Microwler
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,355 @@
+"""
+Persistent cache of crawled pages, one per domain in `./.microwler/cache/<domain>`.
+"""
+import base64
+import binascii
+import os
+import pickle
+import sqlite3
+import threading
+import zlib
+
+EVICTION_POLICIES = ('least-recently-stored', 'least-recently-used', 'least-frequently-used')
+# dictionaries are stored by ID next to the cache, this key holds the ID of the one used for new entries
+DICTIONARY_KEY = 'current'
+DICTIONARY_SIZE = 16 * 1024
+DICTIONARY_SAMPLES = 100
+RAW, ZLIB, ZSTD, ZSTD_DICT = b'\x00', b'\x01', b'\x02', b'\x03'
+_MISSING = object()
+
+
+def encode_cursor(url: str):
+    return base64.urlsafe_b64encode(url.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str):
+    try:
+        return base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    except (binascii.Error, UnicodeError):
+        raise ValueError(f'Invalid cursor: {cursor}')
+
+
+class CacheIndex:
+    """
+    Secondary indexes on `status_code`, `depth` and `discovered` of cached pages, kept in an SQLite database
+    next to the cache and updated whenever entries are written. Pages which have expired or were evicted
+    are removed from the index when a query comes across them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+
+    @property
+    def _db(self):
+        # one connection per thread (i.e. `run_async` caches in an executor), none shared with forked processes
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            # only `close()` uses connections of other threads
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self._local.connection, self._local.pid = connection, os.getpid()
+            self._connections.append((connection, os.getpid()))
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS pages '
+                '(url TEXT PRIMARY KEY, status_code INTEGER, depth INTEGER, discovered TEXT)'
+            )
+            for column in ('status_code', 'depth', 'discovered'):
+                connection.execute(f'CREATE INDEX IF NOT EXISTS pages_{column} ON pages ({column}, url)')
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        return connection
+
+    def _transaction(self, statement: str, rows: list):
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(statement, rows)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def add(self, entries: list):
+        """ Indexes `(url, entry)` pairs """
+        rows = [
+            (url, entry.get('status_code'), entry.get('depth'), entry.get('discovered'))
+            for url, entry in entries
+        ]
+        if rows:
+            self._transaction('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)', rows)
+
+    def remove(self, urls: list):
+        if urls:
+            self._transaction('DELETE FROM pages WHERE url = ?', [(url,) for url in urls])
+
+    @property
+    def built(self):
+        return self._db.execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone() is not None
+
+    def mark_built(self):
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('built', '1')")
+
+    def search(self, limit: int, after: str = None, status_code: int = None, depth: int = None,
+               discovered_since: str = None, discovered_until: str = None, prefix: str = None):
+        """ Returns up to `limit` URLs matching all given filters, ordered by URL and starting after `after` """
+        clauses, params = [], []
+        if after is not None:
+            clauses.append('url > ?')
+            params.append(after)
+        if prefix:
+            # a range on the primary key instead of LIKE, which could not use it
+            clauses.append('url >= ? AND url < ?')
+            params += [prefix, prefix + '\U0010ffff']
+        for clause, value in (('status_code = ?', status_code), ('depth = ?', depth),
+                              ('discovered >= ?', discovered_since), ('discovered <= ?', discovered_until)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        rows = self._db.execute(f'SELECT url FROM pages {where} ORDER BY url LIMIT ?', params + [limit])
+        return [url for (url,) in rows]
+
+    def clear(self):
+        self._db.execute('DELETE FROM pages')
+
+    def close(self):
+        for connection, pid in self._connections:
+            if pid == os.getpid():
+                connection.close()
+        self._connections = []
+        self._local = threading.local()
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('The "zstandard" package is required for zstd compressed caches')
+    return zstandard
+
+
+class PageCache:
+    """
+    Stores cache entries (see `Page.to_dict()`) by URL in a `diskcache.Cache`. Entries are compressed
+    and written in bulk transactions, they may expire and the cache is bounded by `size_limit`.
+    SQLite takes care of locking, so several processes (i.e. the CLI and the web service) can share a cache.
+
+    With `zstd` compression, a dictionary is trained on the first batch of entries and shared by all of them,
+    which compresses small entries much better. Dictionaries are kept in a separate store without eviction and
+    entries are decoded with the dictionary whose ID is recorded in their zstd frame.
+
+    Use `query()` to page through the cache instead of loading all entries with `values()`.
+    """
+
+    def __init__(self, directory: str, size_limit: int = 2 ** 30, eviction_policy: str = 'least-recently-stored',
+                 ttl: float = None, compression: str = 'zlib'):
+        """
+        Arguments:
+            directory: the folder of the cache
+            size_limit: maximum size in bytes, `None` for no limit
+            eviction_policy: which entries to drop first when the cache is full, one of `EVICTION_POLICIES`
+            ttl: seconds after which entries expire, `None` to keep them forever
+            compression: `'zlib'`, `'zstd'` (requires `zstandard`) or `None`
+        """
+        if compression not in (None, 'zlib', 'zstd'):
+            raise ValueError(f'Unknown cache_compression: {compression} (expected "zlib", "zstd" or None)')
+        if eviction_policy not in EVICTION_POLICIES:
+            raise ValueError(f'Unknown cache_eviction: {eviction_policy} (expected one of {", ".join(EVICTION_POLICIES)})')
+        from diskcache import Cache
+        if size_limit is None:
+            self._cache = Cache(directory, eviction_policy='none')
+        else:
+            self._cache = Cache(directory, size_limit=size_limit, eviction_policy=eviction_policy)
+        self.directory = directory
+        self.ttl = ttl
+        self.compression = compression
+        self._zstd = _import_zstandard() if compression == 'zstd' else None
+        self._dictionaries = None
+        self._dictionary = None
+        self._decoders = {}
+        self._index = CacheIndex(os.path.join(directory, 'index.sqlite3'))
+
+    @classmethod
+    def from_settings(cls, domain: str, settings):
+        return cls(
+            f'./.microwler/cache/{domain}', size_limit=settings.cache_size_limit,
+            eviction_policy=settings.cache_eviction, ttl=settings.cache_ttl, compression=settings.cache_compression,
+        )
+
+    @property
+    def _dictionary_store(self):
+        # created on first use, so caches without zstd dictionaries don't get the folder
+        if self._dictionaries is None:
+            from diskcache import Cache
+            self._dictionaries = Cache(os.path.join(self.directory, 'dictionaries'), eviction_policy='none')
+        return self._dictionaries
+
+    def _load_dictionary(self, dict_id: int = None):
+        """ Returns the dictionary with the given ID, or the one for new entries """
+        if dict_id is None:
+            if self._dictionary is None:
+                current = self._dictionary_store.get(DICTIONARY_KEY, retry=True)
+                self._dictionary = None if current is None else self._load_dictionary(current)
+            return self._dictionary
+        if dict_id not in self._decoders:
+            data = self._dictionary_store.get(dict_id, retry=True)
+            if data is None:
+                raise ValueError(f'Missing zstd dictionary {dict_id} in cache: {self.directory}')
+            self._zstd = self._zstd or _import_zstandard()
+            self._decoders[dict_id] = self._zstd.ZstdCompressionDict(data)
+        return self._decoders[dict_id]
+
+    def _train_dictionary(self, payloads: list):
+        """ Trains the shared dictionary, the first process to store one wins """
+        try:
+            trained = self._zstd.train_dictionary(DICTIONARY_SIZE, payloads)
+        except self._zstd.ZstdError:
+            return
+        self._dictionary_store.add(trained.dict_id(), trained.as_bytes(), retry=True)
+        self._dictionary_store.add(DICTIONARY_KEY, trained.dict_id(), retry=True)
+
+    def _encode(self, payload: bytes, dictionary=None):
+        if self.compression == 'zlib':
+            return ZLIB + zlib.compress(payload)
+        if self.compression == 'zstd':
+            if dictionary is not None:
+                return ZSTD_DICT + self._zstd.ZstdCompressor(dict_data=dictionary).compress(payload)
+            return ZSTD + self._zstd.ZstdCompressor().compress(payload)
+        return RAW + payload
+
+    def _decode(self, value):
+        # entries written by earlier versions (diskcache.Index) are plain dicts
+        if isinstance(value, dict):
+            return value
+        header, data = value[:1], value[1:]
+        if header == ZLIB:
+            data = zlib.decompress(data)
+        elif header in (ZSTD, ZSTD_DICT):
+            self._zstd = self._zstd or _import_zstandard()
+            dictionary = None
+            if header == ZSTD_DICT:
+                dictionary = self._load_dictionary(self._zstd.get_frame_parameters(data).dict_id)
+            data = self._zstd.ZstdDecompressor(dict_data=dictionary).decompress(data)
+        return pickle.loads(data)
+
+    def set_many(self, entries: list, expire: float = None):
+        """ Stores `(url, entry)` pairs in one transaction, `expire` (in seconds) defaults to `ttl` """
+        if not entries:
+            return
+        expire = self.ttl if expire is None else expire
+        payloads = [pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL) for _, entry in entries]
+        dictionary = None
+        if self.compression == 'zstd':
+            dictionary = self._load_dictionary()
+            if dictionary is None and len(payloads) >= DICTIONARY_SAMPLES:
+                self._train_dictionary(payloads)
+                dictionary = self._load_dictionary()
+        # compress before taking the lock, so other processes wait as little as possible
+        values = [self._encode(payload, dictionary) for payload in payloads]
+        with self._cache.transact(retry=True):
+            for (url, _), value in zip(entries, values):
+                self._cache.set(url, value, expire=expire)
+        self._index.add(entries)
+
+    def __setitem__(self, url: str, entry: dict):
+        self.set_many([(url, entry)])
+
+    def get(self, url: str, default=None):
+        value = self._cache.get(url, default=_MISSING, retry=True)
+        return default if value is _MISSING else self._decode(value)
+
+    def __getitem__(self, url: str):
+        value = self._cache.get(url, default=_MISSING, retry=True)
+        if value is _MISSING:
+            raise KeyError(url)
+        return self._decode(value)
+
+    def __contains__(self, url: str):
+        return url in self._cache
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __iter__(self):
+        return self._cache.iterkeys()
+
+    def values(self):
+        """ Yields all entries which have not expired, one by one """
+        for url in self:
+            entry = self.get(url, _MISSING)
+            if entry is not _MISSING:
+                yield entry
+
+    def build_index(self):
+        """
+        Indexes entries written before the index existed, i.e. by earlier versions. This reads the whole cache,
+        so it is done only once. `query()` calls it if necessary, services should call it in the background.
+        """
+        if self._index.built:
+            return
+        batch = []
+        for url in self:
+            entry = self.get(url, _MISSING)
+            if entry is not _MISSING:
+                batch.append((url, entry))
+            if len(batch) >= 1000:
+                self._index.add(batch)
+                batch = []
+        self._index.add(batch)
+        self._index.mark_built()
+
+    def query(self, limit: int = 100, cursor: str = None, status_code: int = None, depth: int = None,
+              discovered_since: str = None, discovered_until: str = None, prefix: str = None):
+        """
+        Returns up to `limit` entries matching all given filters, ordered by URL, and the cursor of the next page
+        (`None` on the last page). Only the entries of the requested page are loaded.
+
+        Arguments:
+            limit: maximum number of entries
+            cursor: the cursor returned by the previous call, `None` for the first page
+            status_code: only pages with this status code
+            depth: only pages found at this depth
+            discovered_since: only pages crawled on or after this date (`YYYY-MM-DD`)
+            discovered_until: only pages crawled on or before this date (`YYYY-MM-DD`)
+            prefix: only URLs starting with this prefix
+        """
+        self.build_index()
+        after = decode_cursor(cursor) if cursor else None
+        filters = dict(status_code=status_code, depth=depth, discovered_since=discovered_since,
+                       discovered_until=discovered_until, prefix=prefix)
+        entries, last = [], None
+        while len(entries) < limit:
+            urls = self._index.search(limit - len(entries), after, **filters)
+            if not urls:
+                return entries, None
+            stale = []
+            for url in urls:
+                entry = self.get(url, _MISSING)
+                if entry is _MISSING:
+                    stale.append(url)
+                else:
+                    entries.append(entry)
+                    last = url
+            self._index.remove(stale)
+            after = urls[-1]
+        return entries, encode_cursor(last)
+
+    def expire(self):
+        """ Removes expired entries, returns their number """
+        return self._cache.expire(retry=True)
+
+    def volume(self):
+        """ Size of the cache on disk in bytes """
+        return self._cache.volume()
+
+    def clear(self):
+        # dictionaries are kept, other processes may still write entries using them
+        self._index.clear()
+        return self._cache.clear(retry=True)
+
+    def close(self):
+        self._index.close()
+        if self._dictionaries is not None:
+            self._dictionaries.close()
+        self._cache.close()
@@ -3,11 +3,9 @@ import sys
 from urllib.parse import urlparse
 
 import click
-from click.testing import CliRunner
 
 from microwler.cli.template import TEMPLATE
 from microwler.utils import load_project, PROJECT_FOLDER
-from microwler.web.backend import start_app
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 COMMANDS = [
@@ -15,6 +13,7 @@ COMMANDS = [
     ('crawler PROJECT_NAME run', 'Run a project\'s crawler'),
     ('crawler PROJECT_NAME dumpcache', 'Dump project getCache to JSON file'),
     ('crawler PROJECT_NAME clearcache', 'Clear project getCache'),
+    ('crawl-all [-w|--workers] [PROJECT_NAMES]', 'Run many or all projects concurrently'),
     ('serve [-p|--port]', 'Start the built-in webservice'),
 ]
 
@@ -103,10 +102,41 @@ def clear_cache(ctx):
         click.secho('Cache is disabled for this project', fg='yellow')
 
 
+@click.command('crawl-all')
+@click.argument('project_names', nargs=-1)
+@click.option('-w', '--workers', type=int, default=1, help='The number of processes to spread the projects across.')
+@click.option('-r', '--max-requests', type=int, default=100, help='The number of requests in flight across all projects.')
+@click.option('-p', '--max-projects', type=int, default=10, help='The number of projects crawled at the same time per process.')
+@click.option('--keep-html', default=False, is_flag=True)
+def crawl_all(project_names, workers, max_requests, max_projects, keep_html):
+    """ Run many or all projects concurrently """
+    import prettytable
+    from microwler.orchestrator import crawl_all as run_projects, list_projects
+
+    projects = [name[:-3] if name.endswith('.py') else name for name in project_names] or list_projects()
+    if not projects:
+        click.secho('No projects found', fg='yellow')
+        exit(0)
+    report = run_projects(projects, workers=workers, max_requests=max_requests,
+                          max_projects=max_projects, keep_source=keep_html)
+    table = prettytable.PrettyTable(['Project', 'Pages', 'Errors', 'Time'])
+    for name, stats in sorted(report['projects'].items()):
+        errors = 'failed' if 'failed' in stats else stats['errors']
+        table.add_row([name, stats['pages'], errors, f'{stats["seconds"]}s'])
+    table.add_row(['Total', report['pages'], report['errors'], f'{report["seconds"]}s'])
+    print(table)
+    click.echo(f'{report["pages_per_second"]} pages/s')
+    if report['failed']:
+        click.secho(f'Failed projects: {", ".join(report["failed"])}', fg='red')
+        exit(1)
+
+
 @click.command('serve')
 @click.option('-p', '--port', type=int, default=5000, help='The port to run the webservice on.')
 def start_server(port):
     """ Start the built-in webservice """
+    from microwler.web.backend import start_app
+
     if not len(os.listdir(PROJECT_FOLDER)):
         click.secho('Running webservice with empty project folder', fg='yellow')
     start_app(port)
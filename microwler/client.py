@@ -0,0 +1,75 @@
+import asyncio
+import atexit
+import os
+import threading
+import weakref
+
+from aiohttp import AsyncResolver, ClientSession, TCPConnector
+
+from microwler.metrics import trace_config
+
+_SESSIONS = weakref.WeakKeyDictionary()
+_LOOPS = weakref.WeakKeyDictionary()
+_local = threading.local()
+
+
+def _client_key(settings):
+    return (
+        tuple(settings.dns_providers or ()), settings.connection_limit, settings.connection_limit_per_host,
+        settings.dns_cache_ttl, settings.keepalive_timeout,
+    )
+
+
+def get_session(settings) -> ClientSession:
+    """
+    Returns the shared `ClientSession` for the running event loop and the given connection settings.
+    Crawlers with the same settings share connections, TLS sessions and cached DNS lookups,
+    so repeated crawls of the same site start warm. Must be called from a coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    sessions = _SESSIONS.setdefault(loop, dict())
+    key = _client_key(settings)
+    session = sessions.get(key)
+    if session is None or session.closed:
+        resolver = AsyncResolver(nameservers=settings.dns_providers) if settings.dns_providers else None
+        connector = TCPConnector(
+            resolver=resolver,
+            limit=settings.connection_limit,
+            limit_per_host=settings.connection_limit_per_host,
+            ttl_dns_cache=settings.dns_cache_ttl,
+            keepalive_timeout=settings.keepalive_timeout,
+        )
+        # metrics are passed per request via `trace_request_ctx`, so the session can be shared
+        session = ClientSession(connector=connector, trace_configs=[trace_config()])
+        sessions[key] = session
+    return session
+
+
+async def close_sessions():
+    """ Closes all shared sessions of the running event loop, i.e. when shutting down a web service """
+    sessions = _SESSIONS.pop(asyncio.get_running_loop(), dict())
+    for session in sessions.values():
+        await session.close()
+
+
+def event_loop():
+    """
+    Returns the event loop used by `Microwler.run()` in the current thread.
+    It stays open between runs, so pooled connections can be reused.
+    """
+    loop = getattr(_local, 'loop', None)
+    # a forked process must not use its parent's loop
+    if loop is None or loop.is_closed() or _local.pid != os.getpid():
+        loop = asyncio.new_event_loop()
+        _local.loop = loop
+        _local.pid = os.getpid()
+        _LOOPS[loop] = _local.pid
+    return loop
+
+
+@atexit.register
+def _shutdown():
+    for loop, pid in list(_LOOPS.items()):
+        if pid == os.getpid() and not loop.is_closed() and not loop.is_running():
+            loop.run_until_complete(close_sessions())
+            loop.close()
@@ -1,21 +1,30 @@
 import asyncio
 import json
 import logging
+import os
+import pickle
 import time
-from typing import Callable, List, Dict, Any, Union
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, List, Dict, Any, Union, TYPE_CHECKING
 
 from urllib.parse import urlparse
 
-import prettytable
-import completely
-from aiohttp import AsyncResolver, TCPConnector, ClientSession
-from diskcache import Index
-from lxml import html as DOMParser
-from parsel import Selector
+from aiohttp import ClientSession, ClientConnectionError, ClientTimeout
 
-from microwler.page import Page
+from microwler.cache import PageCache
+from microwler.frontier import DepthFrontier, FrontierCheckpoint
+from microwler.metrics import Metrics
+from microwler.page import Page, scrape_chunk
+from microwler.scheduler import FairBudget, HostScheduler, RETRY_STATUSES
 from microwler.settings import Settings
-from microwler import utils
+from microwler.urlfilter import URLFilter
+from microwler.urlset import make_url_set, url_hash
+from microwler import client, discovery, distributed, utils
+
+if TYPE_CHECKING:
+    from parsel import Selector
 
 LOG = logging.getLogger(__name__)
 
@@ -27,7 +36,7 @@ class Microwler:
 
     def __init__(self,
                  start_url: str,
-                 select: Dict[str, Union[str, Callable[[Selector], Any]]] = None,
+                 select: Dict[str, Union[str, Callable[['Selector'], Any]]] = None,
                  transform: Callable[[dict], dict] = None,
                  settings: dict = None):
         """
@@ -45,126 +54,684 @@ class Microwler:
         self._selectors = select
         self._transformer = transform
         self._settings = Settings(settings)
-        self._seen_urls = set()
+        # compiled once per crawler instead of once per page
+        self._compiled_selectors = utils.compile_selectors(select)
+        self._link_filter = utils.compile_xpath(self._settings.link_filter)
+        self._url_filter = URLFilter(
+            include=self._settings.include_urls, exclude=self._settings.exclude_urls,
+            strip_params=self._settings.strip_params, ignored_extensions=self._settings.ignored_extensions,
+            cache_size=self._settings.url_cache_size,
+        )
+        self._seen_urls = make_url_set(
+            self._settings.visited_set, self._settings.visited_capacity, self._settings.bloom_error_rate
+        )
         self._session: Union[ClientSession, None] = None
-        self._limiter = asyncio.BoundedSemaphore(self._settings.max_concurrency)
+        self._frontier: Union[DepthFrontier, None] = None
+        self._scheduler: Union[HostScheduler, None] = None
+        self._budget: Union[FairBudget, None] = None
+        self._robots = None
+        self._executor: Union[Executor, None] = None
         self._verbose = False
+        self._keep_source = False
         self._errors = dict()
         self._results = dict()
+        self._validators = dict()
+        self._fingerprints = dict()
+        self._content_index = dict()
+        self._duplicates = dict()
+        self._unchanged = set()
+        self._exporters = []
+        self._export_buffer = []
+        self._cache_buffer = []
+        self._metrics = Metrics()
+        self._project_path = None
+        self._backend = None
+        self._outbox = []
+        self._processed = []
+        self._finished = []
+        self._checkpoint = None
+        if self._settings.resumable:
+            self._checkpoint = FrontierCheckpoint(self._domain, self._settings.checkpoint_interval)
         self.set_cache()
 
     def set_cache(self, force=False):
         if self._settings.caching or force:
-            self._cache = Index(f'./.microwler/cache/{self._domain}')
+            self._cache = PageCache.from_settings(self._domain, self._settings)
         else:
             self._cache = None
 
-    async def _get(self, url):
-        async with self._limiter:
-            try:
-                heads = utils.get_headers(self._settings.language)
-                async with self._session.get(url, timeout=15, headers=heads) as response:
-                    text = await response.text()
-                    if self._verbose:
-                        LOG.info(f'Processed: {url} [{response.status}]')
-                    return text, response.status
-            except TimeoutError:
+    def _accept(self, url, response):
+        """ Checks `Content-Type` and `Content-Length` before the body is downloaded """
+        allowed = self._settings.allowed_content_types
+        if allowed and 'Content-Type' in response.headers and response.content_type not in allowed:
+            reason = response.content_type
+        elif response.content_length is not None and response.content_length > self._settings.max_body_size:
+            reason = f'{response.content_length} bytes'
+        else:
+            return True
+        if self._verbose:
+            LOG.info(f'Skipped: {url} [{reason}]')
+        self._metrics.inc('skipped')
+        return False
+
+    async def _read(self, url, response):
+        """ Reads the body in chunks, returns `None` if it exceeds `max_body_size` """
+        limit = self._settings.max_body_size
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(1 << 16):
+            body += chunk
+            if len(body) > limit:
                 if self._verbose:
-                    LOG.warning(f'Timeout error: {url}')
-                return None, None
-
-    def _find_links(self, html):
-        """ Extract relevant links from an HTML document """
-        dom = DOMParser.fromstring(html)
-        dom.make_links_absolute(self._base_url)
-        links = {
-            link for link in dom.xpath(self._settings.link_filter)
-            if link.startswith(self._base_url)  # stay on this website
-            if link not in self._results  # try to filter global duplicates in order to avoid extra loop steps later
-            and not any([link.lower().endswith(e) for e in utils.IGNORED_EXTENSIONS])  # ignore file extensions
-        }
-        return list(links)
+                    LOG.info(f'Skipped: {url} [more than {limit} bytes]')
+                self._metrics.inc('skipped')
+                return None
+        return bytes(body)
 
-    async def _get_one(self, url):
+    async def _get(self, url, validators: dict = None):
+        """
+        Downloads a URL. Returns the raw body, the status and the headers, with the body being `None`
+        if the response was skipped (see `allowed_content_types` and `max_body_size`) or all of them
+        being `None` after a timeout.
+        """
+        heads = utils.get_headers(self._settings.language)
+        if validators:
+            if 'etag' in validators:
+                heads['If-None-Match'] = validators['etag']
+            if 'last_modified' in validators:
+                heads['If-Modified-Since'] = validators['last_modified']
+        retries = self._settings.max_retries
+        metrics = self._metrics
+        for attempt in range(retries + 1):
+            if attempt:
+                metrics.inc('retries')
+            wait_start = time.perf_counter()
+            async with self._scheduler.slot(url) as slot:
+                start = time.perf_counter()
+                metrics.observe('wait', start - wait_start)
+                metrics.inc('requests')
+                metrics.gauge('in_flight', delta=1)
+                try:
+                    async with self._session.get(url, timeout=15, headers=heads, trace_request_ctx=metrics) as response:
+                        if response.status not in RETRY_STATUSES or attempt == retries:
+                            body = None
+                            if response.status == 304 or self._accept(url, response):
+                                body = await self._read(url, response)
+                            metrics.observe('download', time.perf_counter() - start)
+                            if self._verbose and body is not None:
+                                LOG.info(f'Processed: {url} [{response.status}]')
+                            return body, response.status, response.headers
+                        slot.failed = True
+                        delay = self._scheduler.backoff(url, attempt, response.headers.get('Retry-After'))
+                        if self._verbose:
+                            LOG.warning(f'Retrying in {round(delay, 2)}s: {url} [{response.status}]')
+                except (asyncio.TimeoutError, ClientConnectionError) as e:
+                    slot.failed = True
+                    if attempt == retries:
+                        if not isinstance(e, asyncio.TimeoutError):
+                            raise
+                        if self._verbose:
+                            LOG.warning(f'Timeout error: {url}')
+                        return None, None, None
+                    delay = self._scheduler.backoff(url, attempt)
+                    if self._verbose:
+                        LOG.warning(f'Retrying in {round(delay, 2)}s: {url} [{type(e).__name__}]')
+                finally:
+                    metrics.gauge('in_flight', delta=-1)
+            await asyncio.sleep(delay)
+
+    async def _find_links(self, html):
+        """
+        Extract relevant links from an HTML document, optionally using the parser pool.
+        Returns the links and the parsed tree, so it can be reused for scraping (not available from the pool).
+        """
+        start = time.perf_counter()
+        dom = None
+        if self._executor is not None:
+            loop = asyncio.get_event_loop()
+            links = await loop.run_in_executor(
+                self._executor, utils.extract_links, html, self._base_url, self._settings.link_filter
+            )
+            # workers only check file extensions, the crawler's filter is memoized in this process
+            links = self._url_filter.filter(links)
+        else:
+            dom = utils.parse_html(html)
+            links = utils.extract_links(dom, self._base_url, self._link_filter, self._url_filter)
+        self._metrics.observe('parse', time.perf_counter() - start)
+        return links, dom
+
+    def _cached_validators(self, url):
+        """ Returns the ETag/Last-Modified validators stored with a cached page """
+        if self._settings.revalidate and url in self._cache:
+            return self._cache[url].get('validators')
+        return None
+
+    def _reuse_cached(self, url, depth, links=None):
+        """
+        Restores an unchanged page from the cache, so it won't be scraped, transformed or cached again.
+        Pass the `links` found in a freshly downloaded body, the cached ones may have been compacted (see `store_links`).
+        """
+        page = Page.from_dict(self._cache[url], compress=self._settings.compress_source)
+        page.depth = depth
+        if links is not None:
+            page.links = links
+        self._unchanged.add(url)
+        return page
+
+    def _is_duplicate(self, url, fingerprint):
+        """ Checks whether the same content has already been crawled under a different URL """
+        original = self._content_index.setdefault(fingerprint, url)
+        if original != url:
+            self._duplicates[url] = original
+            if self._verbose:
+                LOG.info(f'Dropped duplicate of {original} [{url}]')
+            return True
+        return False
+
+    async def _get_one(self, url, depth):
+        """ Returns the page and its parsed tree (if any), or `(None, None)` """
         try:
-            text, status = await self._get(url)
-            if text is None and status is None:
+            validators = self._cached_validators(url)
+            body, status, headers = await self._get(url, validators)
+            if status is None:
                 self._errors[url] = 'Timeout Error'
-            else:
-                links = self._find_links(text)
-                return url, status, text, links
+                self._metrics.inc('errors')
+            elif status in RETRY_STATUSES:
+                # retries are exhausted, record the status rather than parsing the error page
+                if self._verbose:
+                    LOG.warning(f'Giving up after {self._settings.max_retries} retries: {url} [{status}]')
+                self._errors[url] = f'HTTP {status}'
+                self._metrics.inc('errors')
+            elif status == 304 and validators:
+                # not modified: reuse the cached page without parsing it again
+                return self._reuse_cached(url, depth), None
+            elif body is not None:
+                text, encoding = utils.decode_body(body, headers.get('Content-Type'))
+                validators = {
+                    key: headers[header] for key, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified'))
+                    if header in headers
+                }
+                if validators:
+                    self._validators[url] = validators
+                unchanged = False
+                if self._cache is not None or self._settings.dedup_content:
+                    fingerprint = utils.fingerprint(text)
+                    if self._settings.dedup_content and self._is_duplicate(url, fingerprint):
+                        return None, None
+                    self._fingerprints[url] = fingerprint
+                    unchanged = self._settings.skip_unchanged and url in self._cache \
+                        and self._cache[url].get('fingerprint') == fingerprint
+                if unchanged and self._settings.store_links == 'full':
+                    return self._reuse_cached(url, depth), None
+                links, dom = await self._find_links(text)
+                if unchanged:
+                    # the cached links have been compacted (see store_links), so take them from the body
+                    return self._reuse_cached(url, depth, links), None
+                # no need to compress if the source is dropped right after scraping
+                compress = self._settings.compress_source and (self._keep_source or not self._settings.streaming)
+                return Page(url, status, depth, links, body, compress=compress, encoding=encoding), dom
         except Exception as e:
             if self._verbose:
                 LOG.error(f'Download error: {e} [{url}]')
             self._errors[url] = str(e)
+            self._metrics.inc('errors')
+        return None, None
+
+    def _compact_links(self, links):
+        """ Applies the `store_links` setting to the links of a page """
+        mode = self._settings.store_links
+        if mode == 'full' or links is None:
+            return links
+        if mode == 'ids':
+            # 63-bit IDs, so they fit into signed integer columns, i.e. when exporting
+            return [url_hash(self._url_filter.normalize(link)) >> 1 for link in links]
+        if mode is None:
             return None
+        raise ValueError(f'Unknown store_links: {mode} (expected "full", "ids" or None)')
 
-    async def _get_batch(self, to_fetch):
-        futures, results = [], []
-        for url in to_fetch:
-            normalized_url = utils.norm_url(url)
-            if normalized_url in self._results:
-                continue
-            if self._settings.delta_crawl:
-                if normalized_url in self._cache:
-                    if self._verbose:
-                        LOG.info(f'Dropped pre-cached URL [{normalized_url}]')
-                    continue
-            self._results[normalized_url] = None
-            futures.append(self._get_one(normalized_url))
+    def _enqueue(self, url, depth, changed=False):
+        """
+        Add a URL to the frontier unless it has been seen before, or lower its depth if it is still queued.
+        URLs known to have changed since they were cached (see `sitemaps`) are queued even with `delta_crawl`.
+        """
+        normalized_url = self._url_filter.normalize(url)
+        if normalized_url in self._seen_urls:
+            if self._backend is None and self._frontier.shorten(normalized_url, depth):
+                if self._checkpoint is not None:
+                    self._checkpoint.queued(normalized_url, depth)
+            return
+        self._seen_urls.add(normalized_url)
+        if self._checkpoint is not None:
+            self._checkpoint.seen(normalized_url)
+        if self._robots is not None and not self._robots.can_fetch(discovery.ROBOTS_AGENT, normalized_url):
+            if self._verbose:
+                LOG.info(f'Dropped URL disallowed by robots.txt [{normalized_url}]')
+            self._metrics.inc('disallowed')
+            return
+        if self._settings.delta_crawl and not self._settings.revalidate and not changed:
+            if normalized_url in self._cache:
+                if self._verbose:
+                    LOG.info(f'Dropped pre-cached URL [{normalized_url}]')
+                return
+        if self._backend is not None:
+            # the backend decides whether the URL is new to all workers and which of them crawls it
+            self._outbox.append((normalized_url, depth))
+            return
+        if self._checkpoint is not None:
+            self._checkpoint.queued(normalized_url, depth)
+        self._frontier.put_nowait((normalized_url, depth))
+
+    async def _worker(self):
+        """ Fetch URLs from the frontier and queue newly found links right away """
+        while True:
+            url, depth = await self._frontier.get()
+            self._metrics.gauge('queue_depth', self._frontier.qsize())
+            try:
+                page, dom = await self._get_one(url, depth)
+                if page is not None:
+                    if depth < self._settings.max_depth:
+                        for link in page.links or []:
+                            self._enqueue(link, depth + 1)
+                    page.links = self._compact_links(page.links)
+                    if self._settings.streaming:
+                        # process right away, so the HTML does not pile up in memory
+                        self._process_page(page, keep_source=self._keep_source, dom=dom)
+                        if not self._keep_source:
+                            page.drop_source()
+                        self._cache_page(page)
+                        self._export_buffer.append(page)
+                        if len(self._export_buffer) >= self._settings.export_batch_size:
+                            self._flush_exports()
+                    elif self._backend is not None:
+                        # scrape right away, results are stored in the backend along with the processed URLs
+                        self._process_page(page, keep_source=self._keep_source, dom=dom)
+                        if not self._keep_source:
+                            page.drop_source()
+                        self._finished.append(page)
+                    self._results[url] = page
+                    self._metrics.inc('pages')
+            except asyncio.CancelledError:
+                # the URL stays pending in the checkpoint
+                raise
+            except Exception as e:
+                LOG.error(f'Error while crawling: {e} [{url}]')
+                self._errors[url] = str(e)
+                self._metrics.inc('errors')
+            finally:
+                self._frontier.task_done(depth)
+            if self._checkpoint is not None:
+                self._checkpoint.done(url)
+            if self._backend is not None:
+                self._processed.append(url)
+
+    async def _run_backend(self, method, *args):
+        """ Distributed mode: calls the backend in the default executor, so its I/O doesn't block the workers """
+        return await asyncio.get_event_loop().run_in_executor(None, method, *args)
+
+    def _backend_entry(self, page: Page):
+        entry = self._cache_entry(page)
+        entry['unchanged'] = page.url in self._unchanged
+        return entry
+
+    async def _sync_backend(self):
+        """
+        Distributed mode: send found links first, then the results and processed URLs, so the crawl can't end
+        prematurely and results are kept if the worker stops early
+        """
+        outbox, processed, finished = self._outbox, self._processed, self._finished
+        self._outbox, self._processed, self._finished = [], [], []
+        entries = [self._backend_entry(page) for page in finished]
+        await self._run_backend(self._backend.add, outbox, self._settings.shards)
+        await self._run_backend(self._backend.save_results, entries)
+        await self._run_backend(self._backend.done, processed)
+
+    async def _feed(self):
+        """ Distributed mode: claim URLs of this worker's shard until all workers are done """
+        size = self._settings.max_concurrency
+        while True:
+            await self._sync_backend()
+            if self._frontier.qsize() < size:
+                batch = await self._run_backend(self._backend.pop, self._settings.shard, size * 2)
+                for url, depth in batch:
+                    self._seen_urls.add(url)
+                    self._frontier.put_nowait((url, depth))
+                if not batch and await self._run_backend(self._backend.remaining) == 0:
+                    return
+            await asyncio.sleep(0.05)
+
+    def _get_executor(self):
+        """ Create the worker pool for link extraction, if enabled via `parser_pool` """
+        kind = self._settings.parser_pool
+        if kind is None:
+            return None
+        workers = self._settings.parser_workers or os.cpu_count()
+        if kind == 'process':
+            return ProcessPoolExecutor(max_workers=workers)
+        if kind == 'thread':
+            return ThreadPoolExecutor(max_workers=workers)
+        raise ValueError(f'Unknown parser_pool: {kind} (expected "process" or "thread")')
+
+    async def _report_metrics(self):
+        """ Pass the current metrics to the `metrics_hook` periodically """
+        while True:
+            await asyncio.sleep(self._settings.metrics_interval)
+            self._emit_metrics()
+
+    def _emit_metrics(self):
+        if self._settings.metrics_hook is not None:
+            try:
+                self._settings.metrics_hook(self._metrics.snapshot())
+            except Exception as e:
+                LOG.warning(f'Metrics hook error: {e} [{self._domain}]')
+
+    async def _fetch_robots(self):
+        """ Returns the content of `robots.txt`, an empty string if there is none or `None` if it is unavailable """
+        url = f'{urlparse(self.start_url).scheme}://{self._domain}/robots.txt'
+        heads = utils.get_headers(self._settings.language)
+        try:
+            async with self._scheduler.slot(url):
+                async with self._session.get(url, timeout=15, headers=heads, trace_request_ctx=self._metrics) as response:
+                    if response.status >= 500:
+                        return None
+                    if response.status != 200:
+                        return ''
+                    body = bytearray()
+                    async for chunk in response.content.iter_chunked(1 << 16):
+                        body += chunk
+                        if len(body) >= discovery.ROBOTS_MAX_SIZE:
+                            break
+                    return bytes(body[:discovery.ROBOTS_MAX_SIZE]).decode('utf-8', errors='replace')
+        except (asyncio.TimeoutError, ClientConnectionError) as e:
+            LOG.warning(f'Could not load robots.txt: {e or type(e).__name__} [{self._domain}]')
+            return None
 
-        for future in asyncio.as_completed(futures):
+    async def _load_robots(self):
+        """ Loads `robots.txt` from the discovery cache or the site and applies it if `respect_robots` is set """
+        store = discovery.RobotsCache(self._domain, self._settings.robots_ttl)
+        try:
+            text = store.get()
+            if text is None:
+                text = await self._fetch_robots()
+                # unavailable files are not cached, so they are requested again next time
+                if text is not None:
+                    store.set(text)
+        finally:
+            store.close()
+        rules = discovery.parse_robots(text or '')
+        if self._settings.respect_robots:
+            self._robots = rules
+            self._scheduler.crawl_delay(self.start_url, rules.crawl_delay(discovery.ROBOTS_AGENT))
+        return rules
+
+    async def _read_sitemap(self, url):
+        """ Streams the entries of a (gzipped) sitemap or sitemap index while it is downloaded """
+        parser = discovery.SitemapParser()
+        heads = utils.get_headers(self._settings.language)
+        timeout = ClientTimeout(sock_connect=15, sock_read=30)
+        async with self._scheduler.slot(url):
+            async with self._session.get(url, timeout=timeout, headers=heads, trace_request_ctx=self._metrics) as response:
+                if response.status != 200:
+                    raise ValueError(f'Unexpected status {response.status}')
+                async for chunk in response.content.iter_chunked(1 << 16):
+                    for entry in parser.feed(chunk):
+                        yield entry
+        for entry in parser.close():
+            yield entry
+
+    def _seed_from_sitemap(self, url, lastmod, delta):
+        """ Queues a URL found in a sitemap, unless (on delta runs) it was cached after its `<lastmod>` date """
+        url = self._url_filter.normalize(url)
+        date = discovery.lastmod_date(lastmod)
+        changed = False
+        if delta and date is not None and url not in self._seen_urls and url in self._cache:
+            if date < self._cache[url].get('discovered', ''):
+                self._seen_urls.add(url)
+                if self._checkpoint is not None:
+                    self._checkpoint.seen(url)
+                if self._settings.revalidate or not self._settings.delta_crawl:
+                    page = self._reuse_cached(url, 1)
+                    self._results[url] = page
+                    if self._settings.streaming:
+                        self._export_buffer.append(page)
+                    elif self._backend is not None:
+                        self._finished.append(page)
+                return
+            changed = True
+        self._enqueue(url, 1, changed=changed)
+
+    async def _discover(self, rules):
+        """ Seeds the frontier from the sitemaps listed in `robots.txt`, following sitemap indexes """
+        scheme = urlparse(self.start_url).scheme
+        pending = deque(rules.site_maps() or [f'{scheme}://{self._domain}/sitemap.xml'])
+        read = set()
+        delta = self._cache is not None and (
+            self._settings.delta_crawl or self._settings.revalidate or self._settings.skip_unchanged
+        )
+        found = 0
+        while pending and len(read) < self._settings.max_sitemaps:
+            url = pending.popleft()
+            if url in read:
+                continue
+            read.add(url)
             try:
-                result = (await future)
-                if result is not None:
-                    results.append(result)
+                async for kind, loc, lastmod in self._read_sitemap(url):
+                    if kind == 'sitemap':
+                        pending.append(loc)
+                    elif loc.startswith(self._base_url) and self._url_filter.accept(loc):
+                        self._seed_from_sitemap(loc, lastmod, delta)
+                        found += 1
             except Exception as e:
-                LOG.error(f'Error while crawling: {e}')
-                exit(1)
-        return results
+                LOG.warning(f'Could not read sitemap: {e or type(e).__name__} [{url}]')
+        LOG.info(f'Found {found} URLs in {len(read)} sitemaps [{self._domain}]')
+
+    def _seed(self):
+        """ Fill the frontier, either from the checkpoint of an interrupted crawl or with the start URL """
+        if self._checkpoint is not None:
+            seen, pending = self._checkpoint.load()
+            if pending:
+                LOG.info(f'Resuming crawl with {len(pending)} pending URLs [{self._domain}]')
+                self._seen_urls.update(seen)
+                for url, depth in pending:
+                    self._frontier.put_nowait((url, depth))
+                return
+        self._enqueue(self.start_url, 0)
 
     async def _crawl(self, loop):
         LOG.info(f'Crawler started [{self._domain}]')
-        resolver = AsyncResolver(nameservers=self._settings.dns_providers)
-        tcpc = TCPConnector(resolver=resolver)
-        self._session = ClientSession(loop=loop, connector=tcpc)
-        pipeline = [self.start_url]
+        self._metrics = Metrics()
+        self._session = client.get_session(self._settings)
+        self._frontier = DepthFrontier()
+        self._scheduler = HostScheduler.from_settings(self._settings, budget=self._budget)
+        self._robots = None
+        rules = None
+        if self._settings.sitemaps or self._settings.respect_robots:
+            rules = await self._load_robots()
+        self._executor = self._get_executor()
+        if self._settings.streaming:
+            self._open_exporters()
+        if self._settings.distributed:
+            self._backend = distributed.make_backend(self._settings.distributed_backend, self._domain)
+        self._seed()
+        workers = [loop.create_task(self._worker()) for _ in range(self._settings.max_concurrency)]
+        if self._settings.metrics_hook is not None:
+            workers.append(loop.create_task(self._report_metrics()))
         try:
-            for depth in range(self._settings.max_depth + 1):
-                batch = await self._get_batch(pipeline)
-                pipeline = []
-                for url, status, text, links in batch:
-                    pipeline.extend(links)
-                    page = Page(url, status, depth, links, text)
-                    self._results[url] = page
+            if self._settings.sitemaps and self._settings.max_depth >= 1:
+                # the workers start with the start URL while the sitemaps are being read
+                await self._discover(rules)
+            if self._backend is not None:
+                await self._feed()
+            else:
+                await self._frontier.join()
+            if self._checkpoint is not None:
+                self._checkpoint.clear()
         finally:
-            await self._session.close()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._settings.streaming:
+                self._flush_exports()
+                self._close_exporters()
+                if self._cache is not None:
+                    self._flush_cache()
+            if self._checkpoint is not None:
+                self._checkpoint.flush()
+            if self._backend is not None:
+                await self._sync_backend()
+                self._backend.close()
+                self._backend = None
+            # the session is shared, see microwler.client
+            self._session = None
             LOG.info(f'Crawler stopped [{self._domain}]')
 
-    def _process(self, sort_urls=False, keep_source=False):
+    def _process_page(self, page: Page, keep_source=False, dom=None):
+        """ Scrape and transform a single page, reusing its parsed tree if given """
+        if self._selectors and page.url not in self._unchanged:
+            with self._metrics.timer('scrape'):
+                page.scrape(self._compiled_selectors, keep_source=keep_source, dom=dom)
+                if self._transformer is not None:
+                    page.transform(self._transformer)
+        return page
+
+    def _scrape_task(self):
+        """
+        Returns what worker processes need to scrape and transform: the selectors and transformer
+        if they can be pickled, otherwise the project module defining them (if any)
+        """
+        try:
+            pickle.dumps((self._selectors, self._transformer))
+            return self._selectors, self._transformer
+        except Exception:
+            return self._project_path
+
+    def _process_in_pool(self, keep_source=False):
+        """ Scrape and transform the results in a process pool, see `scrape_pool` """
+        pages = [page for page in self._results.values() if page.url not in self._unchanged]
+        task = self._scrape_task()
+        if task is None:
+            LOG.warning(f'Selectors or transformer cannot be pickled, scraping in the main process [{self._domain}]')
+            for page in pages:
+                self._process_page(page, keep_source=keep_source)
+            return
+
+        size = self._settings.scrape_chunk_size
+        chunks = [pages[i:i + size] for i in range(0, len(pages), size)]
+        workers = self._settings.scrape_workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(scrape_chunk, task, chunk)
+                for chunk in chunks
+            ]
+            for chunk, future in zip(chunks, futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    LOG.warning(f'Scrape pool error: {e}, falling back to the main process [{self._domain}]')
+                    for page in chunk:
+                        self._process_page(page, keep_source=keep_source)
+                    continue
+                for page, (data, seconds) in zip(chunk, results):
+                    page.data = data
+                    self._metrics.observe('scrape', seconds)
+                    if not keep_source:
+                        page.drop_source()
+
+    def _cache_entry(self, page: Page):
+        """ Returns the cache entry of a page, including its validators and fingerprint """
+        entry = page.to_dict()
+        validators = self._validators.pop(page.url, None)
+        if validators:
+            entry['validators'] = validators
+        fingerprint = self._fingerprints.pop(page.url, None)
+        if fingerprint:
+            entry['fingerprint'] = fingerprint
+        return entry
+
+    def _cache_page(self, page: Page):
+        """ Buffer the cache entry of a page, entries are written in batches of `cache_batch_size` """
+        if self._cache is None or page.url in self._errors or page.url in self._unchanged:
+            return
+        self._cache_buffer.append((page.url, self._cache_entry(page)))
+        if len(self._cache_buffer) >= self._settings.cache_batch_size:
+            self._flush_cache()
+
+    def _flush_cache(self):
+        entries, self._cache_buffer = self._cache_buffer, []
+        if entries:
+            with self._metrics.timer('cache'):
+                self._cache.set_many(entries)
+
+    def _open_exporters(self):
+        self._exporters = []
+        for exporter_cls in self._settings.exporters:
+            exporter = exporter_cls(self._domain, None, self._settings)
+            try:
+                exporter.open()
+                self._exporters.append(exporter)
+            except Exception as e:
+                LOG.error(f'Error during export: {e or type(e).__name__} [{self._domain}]')
+
+    def _flush_exports(self):
+        """ Hand buffered pages to all exporters """
+        pages, self._export_buffer = self._export_buffer, []
+        if self._settings.export_changed_only:
+            pages = [page for page in pages if page.url not in self._unchanged]
+        if not pages:
+            return
+        for exporter in list(self._exporters):
+            try:
+                with self._metrics.timer('export'):
+                    exporter.write_batch(pages)
+            except Exception as e:
+                LOG.error(f'Error during export: {e or type(e).__name__} [{self._domain}]')
+                self._exporters.remove(exporter)
+                try:
+                    exporter.abort()
+                except Exception as e:
+                    LOG.error(f'Error during export: {e or type(e).__name__} [{self._domain}]')
+
+    def _close_exporters(self):
+        for exporter in self._exporters:
+            try:
+                with self._metrics.timer('export'):
+                    exporter.close()
+            except Exception as e:
+                LOG.error(f'Error during export: {e or type(e).__name__} [{self._domain}]')
+        self._exporters = []
+
+    def _process(self, sort_urls=False, keep_source=False, scrape=True, export=True, cache=True):
+        """ Scrape, export and cache the results after crawling, the stages can be skipped individually """
         if sort_urls:
             LOG.info(f'Sorting results ... [{self._domain}]')
             self._results = {url: self._results[url] for url in sorted(self._results)}
 
-        if self._selectors:
+        streaming = self._settings.streaming
+        if self._selectors and scrape and not streaming:
             LOG.info(f'Extracting data ... [{self._domain}]')
-            for url, page in self._results.items():
-                self._results[url] = page.scrape(self._selectors, keep_source=keep_source)
+            if self._settings.scrape_pool:
+                self._process_in_pool(keep_source=keep_source)
+            else:
+                for page in self._results.values():
+                    self._process_page(page, keep_source=keep_source)
 
-                if self._transformer is not None:
-                    self._results[url] = page.transform(self._transformer)
         count = len(self._settings.exporters)
-        if count:
+        if count and export and not streaming:
             LOG.info(f'Exporting to {count} destinations... [{self._domain}]')
-            for exporter_cls in self._settings.exporters:
-                instance = exporter_cls(self._domain, list(self._results.values()), self._settings)
-                instance.export()
+            self._open_exporters()
+            pages = list(self._results.values())
+            size = self._settings.export_batch_size
+            for i in range(0, len(pages), size):
+                self._export_buffer = pages[i:i + size]
+                self._flush_exports()
+            self._close_exporters()
 
-        if self._cache is not None:
+        if self._cache is not None and cache and not streaming:
             LOG.info(f'Caching results ... [{self._domain}]')
             for page in self._results.values():
-                if page.url not in self._errors:
-                    self._cache[page.url] = page.__dict__
+                self._cache_page(page)
+            self._flush_cache()
 
     def run(self, verbose: bool = False, sort_urls: bool = False, keep_source: bool = False):
         """
@@ -176,16 +743,26 @@ class Microwler:
         """
 
         self._verbose = verbose
+        self._keep_source = keep_source
         start = time.time()
         LOG.info('Starting engine ...')
-        loop = asyncio.get_event_loop()
-        future = asyncio.Task(self._crawl(loop=loop))
-        loop.run_until_complete(future)
-        loop.close()
+        loop = client.event_loop()
+        asyncio.set_event_loop(loop)
+        future = loop.create_task(self._crawl(loop=loop))
+        try:
+            loop.run_until_complete(future)
+        except KeyboardInterrupt:
+            # let the crawler shut down cleanly, i.e. to write its checkpoint
+            future.cancel()
+            loop.run_until_complete(asyncio.gather(future, return_exceptions=True))
+            raise
         crawl_time = time.time() - start
 
         if len(self._results):
             self._process(sort_urls=sort_urls, keep_source=keep_source)
+            self._emit_metrics()
+            import completely
+            import prettytable
             total_time = time.time() - start
             table = prettytable.PrettyTable()
             table.add_column('Pages', [len(self._results)])
@@ -202,40 +779,80 @@ class Microwler:
     async def run_async(self, event_loop, sort_urls: bool = False, keep_source: bool = False):
         """
         For running the crawler from another `asyncio` app, which has an existing event loop, i.e. Quart.
+        Connections are pooled per event loop and reused by later runs,
+        call `microwler.client.close_sessions()` when shutting down the app.
+        Scraping, exporting and caching run in a thread, so they don't block the event loop.
         Arguments:
              event_loop: existing event loop, i.e. as a result of asyncio.get_event_loop()
              sort_urls: sort results alphabetically by URL
              keep_source: per default, if selectors are defined, the HTML source will be discarded
         """
+        self._keep_source = keep_source
         await event_loop.create_task(self._crawl(event_loop))
         if len(self._results):
-            self._process(sort_urls=sort_urls, keep_source=keep_source)
+            await event_loop.run_in_executor(None, partial(self._process, sort_urls=sort_urls, keep_source=keep_source))
+            self._emit_metrics()
 
     @property
     def results(self) -> [dict]:
-        return [page.__dict__ for page in self._results.values()]
+        return [page.to_dict() for page in self._results.values()]
+
+    def iter_results(self):
+        """ Yields the results one by one, instead of building the whole list like `crawler.results` """
+        for page in list(self._results.values()):
+            yield page.to_dict()
+
+    @property
+    def progress(self) -> dict:
+        """ Number of crawled pages, errors and queued URLs, i.e. to monitor a running crawl """
+        return {
+            'pages': len(self._results),
+            'errors': len(self._errors),
+            'queued': self._frontier.qsize() if self._frontier is not None else 0,
+        }
 
     @property
     def errors(self) -> dict:
         return self._errors
 
+    @property
+    def metrics(self) -> Metrics:
+        """ Stage timings, counters and gauges of the last run ([read more](/microwler/faq/#how-can-i-monitor-a-crawl)) """
+        return self._metrics
+
+    @property
+    def duplicates(self) -> dict:
+        """ URLs which were dropped because of duplicate content, mapped to the URL that was kept """
+        return self._duplicates
+
     @property
     def cache(self):
+        """ All cached pages, use `query_cache()` for large caches """
         if self._cache is not None:
             return list(self._cache.values())
         raise ValueError('Cache is disabled')
 
+    def query_cache(self, limit: int = 100, cursor: str = None, **filters):
+        """
+        Returns a page of cached pages and the cursor of the next one (`None` on the last page),
+        see `microwler.cache.PageCache.query()` for the available filters.
+        """
+        if self._cache is not None:
+            return self._cache.query(limit=limit, cursor=cursor, **filters)
+        raise ValueError('Cache is disabled')
+
     def clear_cache(self):
         if self._cache is not None:
             size = len(self._cache)
             self._cache.clear()
             LOG.info(f'Removed {size} items from cache')
+            return
         raise ValueError('Cache is disabled')
 
     def dump_cache(self, path: str = None):
         path = path or f'./dump-{self._domain}.json'
         with open(path, 'w') as file:
-            file.write(json.dumps([page.__dict__ for page in self._cache.values()]))
+            file.write(json.dumps(list(self._cache.values())))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,105 @@
+"""
+URL discovery via `robots.txt` and sitemaps, see the `sitemaps` and `respect_robots` settings.
+"""
+import logging
+import re
+import zlib
+from urllib.robotparser import RobotFileParser
+
+LOG = logging.getLogger(__name__)
+
+# groups for this token in `robots.txt` take precedence over `User-agent: *`
+ROBOTS_AGENT = 'microwler'
+# the size limit used by major search engines
+ROBOTS_MAX_SIZE = 500 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+DATE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+class SitemapParser:
+    """
+    Incremental parser for sitemaps and sitemap indexes. It is fed with chunks of the (optionally gzipped)
+    document as they are downloaded and returns `(kind, loc, lastmod)` tuples, where `kind` is `'url'`
+    for pages and `'sitemap'` for nested sitemaps. Parsed elements are discarded right away,
+    so memory usage does not grow with the size of the sitemap.
+    """
+
+    def __init__(self):
+        from lxml import etree
+        self._inflate = None
+        self._started = False
+        self._parser = etree.XMLPullParser(events=('end',), resolve_entities=False, no_network=True, huge_tree=True)
+
+    def feed(self, chunk: bytes):
+        if not self._started:
+            self._started = True
+            if chunk.startswith(GZIP_MAGIC):
+                self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self._inflate is not None:
+            chunk = self._inflate.decompress(chunk)
+        self._parser.feed(chunk)
+        return self._collect()
+
+    def close(self):
+        if self._inflate is not None:
+            self._parser.feed(self._inflate.flush())
+        self._parser.close()
+        return self._collect()
+
+    def _collect(self):
+        entries = []
+        for _, element in self._parser.read_events():
+            kind = _local_name(element.tag)
+            if kind not in ('url', 'sitemap'):
+                continue
+            loc = lastmod = None
+            for child in element:
+                name = _local_name(child.tag)
+                if name == 'loc':
+                    loc = (child.text or '').strip()
+                elif name == 'lastmod':
+                    lastmod = (child.text or '').strip()
+            if loc:
+                entries.append((kind, loc, lastmod))
+            element.clear()
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+        return entries
+
+
+def lastmod_date(lastmod: str):
+    """ Returns the date (`YYYY-MM-DD`) of a W3C datetime, the format used by `<lastmod>`, or `None` """
+    if lastmod and DATE.match(lastmod):
+        return lastmod[:10]
+    return None
+
+
+class RobotsCache:
+    """ Caches `robots.txt` files per domain in `./.microwler/discovery/<domain>` for `ttl` seconds """
+
+    def __init__(self, domain: str, ttl: int = 86400):
+        from diskcache import Cache
+        self._store = Cache(f'./.microwler/discovery/{domain}')
+        self._ttl = ttl
+
+    def get(self):
+        return self._store.get('robots.txt')
+
+    def set(self, text: str):
+        self._store.set('robots.txt', text, expire=self._ttl)
+
+    def close(self):
+        self._store.close()
+
+
+def parse_robots(text: str):
+    """ Parses the content of a `robots.txt` file """
+    rules = RobotFileParser()
+    rules.parse(text.splitlines())
+    return rules
@@ -0,0 +1,307 @@
+"""
+Distributed crawling: several crawler processes, on one or many hosts, share the frontier and the visited set
+of a single domain through a backend. Every URL belongs to one shard (by hash), each worker crawls one shard.
+Workers store their results in the backend, which are merged into the project's cache and exporters afterwards.
+
+Backends are chosen by URL:
+
+- `sqlite:///path/to/file.sqlite3` for workers on the same host (default)
+- `redis://host:6379/0` for workers on many hosts (requires the `redis` package)
+
+Frontier items and results are stored as JSON, so data read from a shared store can't run code on the workers.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+from microwler import client
+from microwler.page import Page
+from microwler.urlset import url_hash
+from microwler.utils import load_project
+
+LOG = logging.getLogger(__name__)
+
+
+def shard_of(url: str, shards: int):
+    """ Returns the shard of a normalized URL """
+    return url_hash(url) % shards
+
+
+class FrontierBackend:
+    """
+    Base class for shared frontiers. URLs are added once (the backend is the visited set of all workers),
+    claimed by the worker of their shard and marked as done after they have been processed.
+    """
+
+    def add(self, items: list, shards: int):
+        """ Adds `(url, depth)` pairs unless they have been added before """
+        raise NotImplementedError
+
+    def pop(self, shard: int, count: int):
+        """ Claims up to `count` queued `(url, depth)` pairs of the given shard """
+        raise NotImplementedError
+
+    def done(self, urls: list):
+        """ Marks claimed URLs as processed """
+        raise NotImplementedError
+
+    def remaining(self):
+        """ Returns the number of URLs which are queued or claimed, the crawl is finished at 0 """
+        raise NotImplementedError
+
+    def save_results(self, entries: list):
+        """ Stores results, i.e. `dict` representations of pages """
+        raise NotImplementedError
+
+    def results(self):
+        """ Iterates over all stored results """
+        raise NotImplementedError
+
+    def clear(self):
+        """ Removes the frontier, the visited set and all results """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend(FrontierBackend):
+    """
+    Shared frontier in an SQLite database, for workers on the same host.
+    Claims expire after `lease` seconds, so URLs of a crashed worker are picked up again by its replacement.
+    """
+
+    def __init__(self, path: str, lease: float = 300.0):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lease = lease
+        self._local = threading.local()
+        self._connections = []
+
+    @property
+    def _db(self):
+        # one connection per thread (i.e. `run_async` caches in an executor), none shared with forked processes
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            # only `close()` uses connections of other threads
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self._local.connection, self._local.pid = connection, os.getpid()
+            self._connections.append((connection, os.getpid()))
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS frontier '
+                '(url TEXT PRIMARY KEY, shard INTEGER, depth INTEGER, state INTEGER DEFAULT 0, claimed REAL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS frontier_shard ON frontier (shard, state)')
+            connection.execute('CREATE TABLE IF NOT EXISTS results (url TEXT PRIMARY KEY, entry TEXT)')
+        return connection
+
+    def _transaction(self, statement: str, rows: list):
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(statement, rows)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def add(self, items: list, shards: int):
+        if items:
+            rows = [(url, shard_of(url, shards), depth) for url, depth in items]
+            self._transaction('INSERT OR IGNORE INTO frontier (url, shard, depth) VALUES (?, ?, ?)', rows)
+
+    def pop(self, shard: int, count: int):
+        db = self._db
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = db.execute(
+                'SELECT url, depth FROM frontier WHERE shard = ? AND (state = 0 OR (state = 1 AND claimed < ?)) '
+                'LIMIT ?', (shard, now - self.lease, count)
+            ).fetchall()
+            claims = [(now, url) for url, _ in rows]
+            db.executemany('UPDATE frontier SET state = 1, claimed = ? WHERE url = ?', claims)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return rows
+
+    def done(self, urls: list):
+        if urls:
+            self._transaction('UPDATE frontier SET state = 2 WHERE url = ?', [(url,) for url in urls])
+
+    def remaining(self):
+        return self._db.execute('SELECT COUNT(*) FROM frontier WHERE state < 2').fetchone()[0]
+
+    def save_results(self, entries: list):
+        if entries:
+            rows = [(entry['url'], json.dumps(entry)) for entry in entries]
+            self._transaction('INSERT OR REPLACE INTO results (url, entry) VALUES (?, ?)', rows)
+
+    def results(self):
+        for (entry,) in self._db.execute('SELECT entry FROM results'):
+            yield json.loads(entry)
+
+    def clear(self):
+        db = self._db
+        db.execute('DELETE FROM frontier')
+        db.execute('DELETE FROM results')
+
+    def close(self):
+        for connection, pid in self._connections:
+            if pid == os.getpid():
+                connection.close()
+        self._connections = []
+        self._local = threading.local()
+
+
+class RedisBackend(FrontierBackend):
+    """
+    Shared frontier in Redis (6.2 or later), for workers on many hosts.
+
+    > Claimed URLs of a crashed worker are not queued again, restart the crawl in that case.
+    """
+
+    def __init__(self, url: str, namespace: str):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError('The "redis" package is required for the Redis backend')
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = f'microwler:{namespace}'
+
+    def add(self, items: list, shards: int):
+        if not items:
+            return
+        pipe = self._redis.pipeline()
+        for url, _ in items:
+            pipe.sadd(f'{self._prefix}:seen', url)
+        added = [item for item, new in zip(items, pipe.execute()) if new]
+        if added:
+            pipe = self._redis.pipeline()
+            for url, depth in added:
+                pipe.rpush(f'{self._prefix}:queue:{shard_of(url, shards)}', json.dumps([url, depth]))
+            pipe.incrby(f'{self._prefix}:remaining', len(added))
+            pipe.execute()
+
+    def pop(self, shard: int, count: int):
+        items = self._redis.lpop(f'{self._prefix}:queue:{shard}', count)
+        return [tuple(json.loads(item)) for item in items or []]
+
+    def done(self, urls: list):
+        if urls:
+            self._redis.decrby(f'{self._prefix}:remaining', len(urls))
+
+    def remaining(self):
+        return int(self._redis.get(f'{self._prefix}:remaining') or 0)
+
+    def save_results(self, entries: list):
+        if entries:
+            self._redis.hset(f'{self._prefix}:results',
+                             mapping={entry['url']: json.dumps(entry) for entry in entries})
+
+    def results(self):
+        for _, entry in self._redis.hscan_iter(f'{self._prefix}:results'):
+            yield json.loads(entry)
+
+    def clear(self):
+        keys = list(self._redis.scan_iter(f'{self._prefix}:*'))
+        if keys:
+            self._redis.delete(*keys)
+
+    def close(self):
+        self._redis.close()
+
+
+def make_backend(url: str, domain: str):
+    """
+    Creates the backend for the given URL
+
+    Arguments:
+        url: `sqlite:///<path>`, `redis://...` or `None` for an SQLite database in `./.microwler/distributed`
+        domain: the domain of the crawler, used as namespace
+    """
+    if url is None:
+        return SQLiteBackend(f'./.microwler/distributed/{domain}.sqlite3')
+    parsed = urlparse(url)
+    if parsed.scheme == 'sqlite':
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if parsed.scheme in ('redis', 'rediss', 'unix'):
+        return RedisBackend(url, domain)
+    raise ValueError(f'Unknown distributed backend: {url} (expected "sqlite:///..." or "redis://...")')
+
+
+def run_worker(project_name: str, shard: int, shards: int, backend: str = None, project_folder: str = None):
+    """
+    Crawls one shard of a project and stores the results in the backend.
+    Start one worker per shard, on any host which can reach the backend. Returns the number of crawled pages.
+    """
+    crawler = load_project(project_name, project_folder).crawler
+    crawler._settings.distributed = True
+    crawler._settings.distributed_backend = backend
+    crawler._settings.shard = shard
+    crawler._settings.shards = shards
+    # the backend is persistent itself and results are cached and exported once they have been merged
+    crawler._settings.streaming = False
+    crawler._checkpoint = None
+    loop = client.event_loop()
+    asyncio.set_event_loop(loop)
+    # pages are scraped while crawling and stored in the backend in batches, see `Microwler._sync_backend`
+    loop.run_until_complete(crawler._crawl(loop))
+    # worker processes skip `atexit` handlers
+    loop.run_until_complete(client.close_sessions())
+    return len(crawler._results)
+
+
+def reset(project_name: str, backend: str = None, project_folder: str = None):
+    """ Clears the backend of a project before starting a new distributed crawl """
+    crawler = load_project(project_name, project_folder).crawler
+    store = make_backend(backend, crawler._domain)
+    store.clear()
+    store.close()
+
+
+def merge(project_name: str, backend: str = None, project_folder: str = None, sort_urls: bool = False):
+    """
+    Merges the results of all workers into the project's crawler, which caches and exports them as usual.
+    Returns the crawler, i.e. to access `crawler.results`.
+    """
+    crawler = load_project(project_name, project_folder).crawler
+    store = make_backend(backend, crawler._domain)
+    for entry in store.results():
+        url = entry['url']
+        # URLs are unique in the backend, so every page is kept exactly once
+        crawler._results[url] = Page.from_dict(entry)
+        if entry.get('unchanged'):
+            crawler._unchanged.add(url)
+        if entry.get('validators'):
+            crawler._validators[url] = entry['validators']
+        if entry.get('fingerprint'):
+            crawler._fingerprints[url] = entry['fingerprint']
+    store.close()
+    crawler._process(sort_urls=sort_urls, keep_source=True, scrape=False)
+    return crawler
+
+
+def crawl_distributed(project_name: str, workers: int = 2, backend: str = None, project_folder: str = None):
+    """
+    Runs a distributed crawl of a project with `workers` processes on this host and merges the results.
+    Returns the crawler, i.e. to access `crawler.results`.
+    """
+    reset(project_name, backend, project_folder)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(run_worker, project_name, shard, workers, backend, project_folder)
+            for shard in range(workers)
+        ]
+        pages = sum(future.result() for future in futures)
+    LOG.info(f'{workers} workers crawled {pages} pages [{project_name}]')
+    return merge(project_name, backend, project_folder)
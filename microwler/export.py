@@ -1,3 +1,6 @@
+import csv
+import gzip
+import io
 import json
 import logging
 import os
@@ -11,23 +14,50 @@ LOG = logging.getLogger(__name__)
 class BaseExporter:
     """
     Use this class to build your custom export functionality, i.e. send data per HTTP or SMTP.
-    The crawler instance will call `export()` once it's done with everything else.
+    The crawler instance will call `open()` once, then `write_batch()` for every batch of processed pages
+    and finally `close()`. Per default, batches are collected in `self.data` and `close()` calls `export()`,
+    so simple plugins only need to implement `export()`.
     You can pass your plugin into the crawler by adding the class to `settings['exporters']`
     """
 
-    def __init__(self, domain: str, data: list, settings: Settings):
+    def __init__(self, domain: str, data: list = None, settings: Settings = None):
         """
         Create a new BaseExporter
 
         Arguments:
             domain: the domain of this project/crawler
-            data: list of processed Page objects
+            data: list of processed Page objects (optional, use `write_batch()` to add pages incrementally)
             settings: the current settings of this project/crawler
         """
         self.domain = domain
-        self.data = [page.__dict__ for page in data]
+        self.data = [page.to_dict() for page in data] if data else []
         self.settings = settings
 
+    def open(self):
+        """
+        Prepare the export destination. Called once before the first batch.
+        """
+        pass
+
+    def write_batch(self, pages: list):
+        """
+        Receive a batch of processed Page objects
+        """
+        self.data.extend(page.to_dict() for page in pages)
+
+    def close(self):
+        """
+        Finish the export. Called once after the last batch.
+        """
+        self.export()
+
+    def abort(self):
+        """
+        Called instead of `close()` if a batch could not be written, no further batches follow.
+        Per default, the collected pages are dropped.
+        """
+        pass
+
     def export(self):
         """
         Export data to target destination
@@ -38,62 +68,411 @@ class BaseExporter:
 class FileExporter(BaseExporter):
     """
     This exporter will save data to your local filesystem. It currently provides
-    exports to JSON, CSV or HTML tables. Take a look at the following exporters
-    and their implementation to understand its usage.
+    exports to JSON, JSON Lines, CSV or HTML tables. Data is written in chunks, one per batch,
+    and can be compressed using the `export_compression` setting (`'gzip'` or `'zstd'`).
+    Subclasses which only implement `convert()` instead of `serialize()` collect all pages
+    in `self.data` and write them at once on `close()`.
+    Take a look at the following exporters and their implementation to understand its usage.
     """
     extension = ''
 
-    def convert(self):
+    def __init__(self, domain: str, data: list = None, settings: Settings = None):
+        super().__init__(domain, data, settings)
+        self.path = None
+        self._file = None
+        self._rows = 0
+
+    def header(self, row: dict = None):
+        """
+        Returns the string to write before the first row. Receives the first row, if there is any.
+        """
+        return ''
+
+    def serialize(self, rows: list, first: bool):
         """
-        Converts `self.data` to output format specified by `FileExporter.extension`.
+        Converts a list of row `dict`s to output format specified by `FileExporter.extension`.
         > Must return converted data as `string`
         """
         raise NotImplementedError()
 
-    def export(self):
-        """ Writes data to file """
-        data = self.convert()
+    def footer(self):
+        """
+        Returns the string to write after the last row.
+        """
+        return ''
+
+    def convert(self):
+        """
+        Converts `self.data` to output format as a whole.
+        > Must return converted data as `string`
+        """
+        head = self.header(self.data[0] if self.data else None)
+        return head + (self.serialize(self.data, first=True) if self.data else '') + self.footer()
+
+    @property
+    def _incremental(self):
+        """ Whether batches are written as they come, unless a subclass implements `convert()` only """
+        cls = type(self)
+        return cls.convert is FileExporter.convert or cls.serialize is not FileExporter.serialize
+
+    def _open_file(self, path: str):
+        compression = self.settings.export_compression
+        if compression is None:
+            return open(path, 'w', encoding='utf-8')
+        if compression == 'gzip':
+            return gzip.open(path, 'wt', encoding='utf-8')
+        if compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError('The "zstandard" package is required for zstd compressed exports')
+            return zstandard.open(path, 'wt', encoding='utf-8')
+        raise ValueError(f'Unknown export_compression: {compression} (expected "gzip" or "zstd")')
+
+    def _make_path(self, suffix: str = ''):
         timestamp = datetime.now().strftime('%Y-%m-%d-%H:%M')
-        path = os.path.join(self.settings.export_to, f'{self.domain}_{timestamp}.{self.extension}')
+        os.makedirs(self.settings.export_to, exist_ok=True)
+        return os.path.join(self.settings.export_to, f'{self.domain}_{timestamp}.{self.extension}{suffix}')
+
+    def open(self):
+        """ Opens the export file """
+        suffix = {'gzip': '.gz', 'zstd': '.zst'}.get(self.settings.export_compression, '')
+        self.path = self._make_path(suffix)
+        self._file = self._open_file(self.path)
+        self._rows = 0
+
+    def _write_rows(self, rows: list):
+        if not rows:
+            return
+        first = self._rows == 0
+        chunk = self.header(rows[0]) if first else ''
+        self._file.write(chunk + self.serialize(rows, first=first))
+        self._rows += len(rows)
+
+    def write_batch(self, pages: list):
+        """ Writes a batch of pages to the export file """
+        if self._incremental:
+            self._write_rows([page.to_dict() for page in pages])
+        else:
+            super().write_batch(pages)
+
+    def close(self):
+        """ Writes the footer and closes the export file """
+        if not self._incremental:
+            self._file.write(self.convert())
+            self._rows = len(self.data)
+        else:
+            if self._rows == 0:
+                self._file.write(self.header(None))
+            self._file.write(self.footer())
+        self._file.close()
+        self._file = None
+        LOG.info(f'Exported {self._rows} pages as {self.extension.upper()} to: {self.path} [{self.domain}]')
+
+    def abort(self):
+        """ Closes the export file after a batch failed, keeping the pages written so far """
+        try:
+            self.close()
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def export(self):
+        """ Writes `self.data` to file """
         try:
-            os.makedirs(self.settings.export_to, exist_ok=True)
-            with open(path, 'w') as file:
-                file.write(data)
-            LOG.info(f'Exported data as {self.extension.upper()} to: {path} [{self.domain}]')
+            self.open()
+            if self._incremental:
+                self._write_rows(self.data)
+            self.close()
         except Exception as e:
-            LOG.error(f'Error during export: {e} [{self.domain}]')
+            LOG.error(f'Error during export: {e or type(e).__name__} [{self.domain}]')
 
 
 class JSONExporter(FileExporter):
     """ Exports to JSON files """
     extension = 'json'
 
-    def convert(self):
-        data = json.dumps(self.data)
-        return data
+    def header(self, row: dict = None):
+        return '['
+
+    def serialize(self, rows: list, first: bool):
+        data = ','.join(json.dumps(row) for row in rows)
+        return data if first else ',' + data
+
+    def footer(self):
+        return ']'
+
+
+class JSONLinesExporter(FileExporter):
+    """ Exports to JSON Lines files, one page per line """
+    extension = 'jsonl'
+
+    def serialize(self, rows: list, first: bool):
+        return ''.join(json.dumps(row) + '\n' for row in rows)
 
 
 class CSVExporter(FileExporter):
     """ Exports to CSV files """
     extension = 'csv'
 
-    def convert(self):
-        headers = ';'.join([key.upper() for key in self.data[0].keys()])
-        rows = '\n'.join([';'.join([str(val) for val in obj.values()]) for obj in self.data])
-        table = '\n'.join([headers, rows])
-        return table
+    def header(self, row: dict = None):
+        if row is None:
+            return ''
+        return ';'.join([key.upper() for key in row.keys()]) + '\n'
+
+    def serialize(self, rows: list, first: bool):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';', lineterminator='\n')
+        writer.writerows([str(val) for val in row.values()] for row in rows)
+        return buffer.getvalue()
 
 
 class HTMLExporter(FileExporter):
     """ Exports data as <table> to HTML files """
     extension = 'html'
 
-    def convert(self):
+    def header(self, row: dict = None):
         styles = 'width: 100%; border: 1px solid grey; text-align: center'
-        headers = ''.join([f'<th>{key.upper()}</th>' for key in self.data[0].keys()])
-        rows = ''.join([f"<tr>{''.join([f'<td>{val}</td>' for val in obj.values()])}</tr>" for obj in self.data])
-        table = f'<!DOCTYPE html><html><body><table style="{styles}"><tr>{headers}</tr><tbody>{rows}</tbody></table><body></html>'
-        return table
+        headers = ''.join([f'<th>{key.upper()}</th>' for key in row.keys()]) if row else ''
+        return f'<!DOCTYPE html><html><body><table style="{styles}"><tr>{headers}</tr><tbody>'
+
+    def serialize(self, rows: list, first: bool):
+        return ''.join([f"<tr>{''.join([f'<td>{val}</td>' for val in obj.values()])}</tr>" for obj in rows])
+
+    def footer(self):
+        return '</tbody></table></body></html>'
+
+
+class ColumnarExporter(FileExporter):
+    """
+    Base class for columnar exports using `pyarrow`. Page attributes become typed columns and
+    every field of `Page.data` becomes its own `data.<field>` column. Each batch is appended as a
+    separate chunk (i.e. a Parquet row group). Columns listed in `dictionary_columns` are dictionary-encoded.
+
+    Column types are inferred from the values seen so far. Selectors return a string for one match and a list
+    for several, so a field with lists becomes a list column and single values are wrapped in a list.
+    Dicts and values which don't fit the column type are JSON-encoded in a string column.
+    If a later batch adds a field or widens a column (e.g. int to float or string), the file written so far is
+    kept as a part and all parts are merged into one file on `close()`, filling missing columns with nulls.
+    """
+    dictionary_columns = ['status_code', 'depth', 'discovered']
+
+    def __init__(self, domain: str, data: list = None, settings: Settings = None):
+        super().__init__(domain, data, settings)
+        self._schema = {}
+        self._parts = []
+        self._writer = None
+        self._dictionaries = {}
+
+    @staticmethod
+    def _import_pyarrow():
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('The "pyarrow" package is required for columnar exports')
+        return pyarrow
+
+    def new_writer(self, schema):
+        """
+        Returns a writer for `self.path` which provides `write_table()` and `close()`
+        """
+        raise NotImplementedError()
+
+    def read_batches(self, path: str):
+        """
+        Yields the record batches of a file written by `new_writer()`
+        """
+        raise NotImplementedError()
+
+    def _columns(self, rows: list):
+        fields = dict.fromkeys(self._schema)
+        fields.update(dict.fromkeys(key for row in rows for key in row if key != 'data'))
+        fields.update(dict.fromkeys(f'data.{key}' for row in rows for key in (row.get('data') or {})))
+        columns = {}
+        for field in fields:
+            if field.startswith('data.'):
+                key = field[5:]
+                columns[field] = [(row.get('data') or {}).get(key) for row in rows]
+            else:
+                columns[field] = [row.get(field) for row in rows]
+        return columns
+
+    def _infer_type(self, name: str, values: list):
+        """ Returns the column type for a batch of values, `null` if there are none """
+        pa = self._import_pyarrow()
+        if name == 'links':
+            return pa.list_(pa.int64() if self.settings.store_links == 'ids' else pa.string())
+        values = [value for value in values if value is not None]
+        if not values:
+            return pa.null()
+        if any(isinstance(value, list) for value in values):
+            return pa.list_(pa.string())
+        if all(isinstance(value, bool) for value in values):
+            return pa.bool_()
+        if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            return pa.int64()
+        if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            return pa.float64()
+        return pa.string()
+
+    def _widen(self, current, value_type):
+        """ Returns a column type which fits both the current type and the type of new values """
+        pa = self._import_pyarrow()
+        if current == value_type or pa.types.is_null(value_type) or pa.types.is_list(current):
+            return current
+        if pa.types.is_null(current):
+            return value_type
+        if {current, value_type} == {pa.int64(), pa.float64()}:
+            return pa.float64()
+        return pa.string()
+
+    def _coerce(self, values: list, value_type):
+        """ Converts values to fit the column type, see the class description """
+        pa = self._import_pyarrow()
+        if pa.types.is_string(value_type):
+            return [value if value is None or isinstance(value, str) else json.dumps(value, default=str)
+                    for value in values]
+        if pa.types.is_list(value_type):
+            return [
+                None if value is None else self._coerce(value if isinstance(value, list) else [value],
+                                                        value_type.value_type)
+                for value in values
+            ]
+        if pa.types.is_floating(value_type):
+            return [None if value is None else float(value) for value in values]
+        return values
+
+    def _encode(self, name: str, values: list, value_type):
+        """ Dictionary-encode a column, keeping the dictionary stable across batches """
+        pa = self._import_pyarrow()
+        mapping = self._dictionaries.setdefault(name, {})
+        indices = [None if value is None else mapping.setdefault(value, len(mapping)) for value in values]
+        dictionary = pa.array(list(mapping), type=value_type)
+        return pa.DictionaryArray.from_arrays(pa.array(indices, type=pa.int32()), dictionary)
+
+    def _arrow_schema(self):
+        pa = self._import_pyarrow()
+        return pa.schema([
+            pa.field(name, pa.dictionary(pa.int32(), value_type) if name in self.dictionary_columns else value_type)
+            for name, value_type in self._schema.items()
+        ])
+
+    def _to_table(self, rows: list):
+        pa = self._import_pyarrow()
+        columns = self._columns(rows)
+        schema = {
+            name: self._widen(self._schema[name], self._infer_type(name, values)) if name in self._schema
+            else self._infer_type(name, values)
+            for name, values in columns.items()
+        }
+        if schema != self._schema:
+            self._finish_part()
+            self._schema = schema
+        arrays = []
+        for name, values in columns.items():
+            value_type = schema[name]
+            values = self._coerce(values, value_type)
+            if name in self.dictionary_columns:
+                arrays.append(self._encode(name, values, value_type))
+            else:
+                arrays.append(pa.array(values, type=value_type, safe=True))
+        return pa.Table.from_arrays(arrays, schema=self._arrow_schema())
+
+    def _finish_part(self):
+        """ Closes the file written so far and keeps it as a part, the schema of later batches changed """
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        part = f'{self.path}.part{len(self._parts)}'
+        os.replace(self.path, part)
+        self._parts.append(part)
+        LOG.debug(f'Export schema changed, merging parts on close: {self.path} [{self.domain}]')
+
+    def _merge_parts(self):
+        """ Rewrites all parts into `self.path` with the final schema, adding missing columns as nulls """
+        pa = self._import_pyarrow()
+        schema = self._arrow_schema()
+        writer = self.new_writer(schema)
+        try:
+            for part in self._parts:
+                for batch in self.read_batches(part):
+                    arrays = []
+                    for field in schema:
+                        if field.name not in batch.schema.names:
+                            arrays.append(pa.nulls(batch.num_rows, type=field.type))
+                            continue
+                        column = batch.column(field.name)
+                        if pa.types.is_dictionary(field.type):
+                            if pa.types.is_dictionary(column.type):
+                                column = column.dictionary_decode()
+                            value_type = field.type.value_type
+                            arrays.append(self._encode(field.name, column.cast(value_type).to_pylist(), value_type))
+                        else:
+                            arrays.append(column.cast(field.type))
+                    writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        finally:
+            writer.close()
+        for part in self._parts:
+            os.remove(part)
+        self._parts = []
+
+    def open(self):
+        """ Determines the export path, the file is created along with the first batch """
+        self._import_pyarrow()
+        self.path = self._make_path()
+        self._rows = 0
+
+    def _write_rows(self, rows: list):
+        if not rows:
+            return
+        table = self._to_table(rows)
+        if self._writer is None:
+            self._writer = self.new_writer(table.schema)
+        self._writer.write_table(table)
+        self._rows += len(rows)
+
+    def close(self):
+        """ Closes the export file, merging parts written with an earlier schema """
+        if self._parts:
+            self._finish_part()
+            self._merge_parts()
+        else:
+            if self._writer is None:
+                self._writer = self.new_writer(self._arrow_schema())
+            self._writer.close()
+            self._writer = None
+        LOG.info(f'Exported {self._rows} pages as {self.extension.upper()} to: {self.path} [{self.domain}]')
+
+
+class ParquetExporter(ColumnarExporter):
+    """ Exports to Parquet files, one row group per batch (requires `pyarrow`) """
+    extension = 'parquet'
+
+    def new_writer(self, schema):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(self.path, schema, compression=self.settings.export_compression or 'snappy')
+
+    def read_batches(self, path: str):
+        import pyarrow.parquet as pq
+        file = pq.ParquetFile(path)
+        for index in range(file.num_row_groups):
+            yield from file.read_row_group(index).to_batches()
+
 
+class ArrowExporter(ColumnarExporter):
+    """ Exports to Arrow IPC files, one record batch per batch (requires `pyarrow`) """
+    extension = 'arrow'
 
+    def new_writer(self, schema):
+        pa = self._import_pyarrow()
+        compression = 'zstd' if self.settings.export_compression == 'zstd' else None
+        options = pa.ipc.IpcWriteOptions(compression=compression, emit_dictionary_deltas=True)
+        return pa.ipc.new_file(self.path, schema, options=options)
 
+    def read_batches(self, path: str):
+        pa = self._import_pyarrow()
+        with pa.ipc.open_file(path) as reader:
+            for index in range(reader.num_record_batches):
+                yield reader.get_batch(index)
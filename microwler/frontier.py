@@ -0,0 +1,160 @@
+import asyncio
+import heapq
+import logging
+from collections import Counter
+
+LOG = logging.getLogger(__name__)
+
+
+class DepthFrontier:
+    """
+    Queue of `(url, depth)` pairs for the crawl workers, handed out in order of depth.
+
+    A URL at depth `d` is only handed out once all URLs at depth `d - 2` or less have been crawled,
+    because until then one of them might still link to it and give it depth `d - 1` (see `shorten()`).
+    This way every URL is crawled at its shortest depth, as in a breadth-first crawl, while pages
+    of two consecutive depths are still fetched concurrently.
+    """
+
+    def __init__(self):
+        self._heap = []
+        # best depth of every URL waiting in the heap, older heap entries of a URL are skipped
+        self._queued = dict()
+        # number of queued or unfinished URLs per depth
+        self._pending = Counter()
+        self._changed = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    def qsize(self):
+        return len(self._queued)
+
+    def put_nowait(self, item):
+        url, depth = item
+        if url in self._queued:
+            if not self.shorten(url, depth):
+                return
+        else:
+            self._queued[url] = depth
+            self._pending[depth] += 1
+            heapq.heappush(self._heap, (depth, url))
+        self._finished.clear()
+        self._changed.set()
+
+    def shorten(self, url: str, depth: int):
+        """ Lowers the depth of a queued URL if a shorter path to it was found, returns whether it did """
+        current = self._queued.get(url)
+        if current is None or current <= depth:
+            return False
+        self._queued[url] = depth
+        self._release(current)
+        self._pending[depth] += 1
+        heapq.heappush(self._heap, (depth, url))
+        self._changed.set()
+        return True
+
+    def _release(self, depth: int):
+        self._pending[depth] -= 1
+        if not self._pending[depth]:
+            del self._pending[depth]
+
+    def _pop(self):
+        while self._heap:
+            depth, url = self._heap[0]
+            if self._queued.get(url) != depth:
+                heapq.heappop(self._heap)
+                continue
+            if min(self._pending) < depth - 1:
+                return None
+            heapq.heappop(self._heap)
+            del self._queued[url]
+            return url, depth
+        return None
+
+    async def get(self):
+        while True:
+            item = self._pop()
+            if item is not None:
+                return item
+            self._changed.clear()
+            await self._changed.wait()
+
+    def task_done(self, depth: int):
+        """ Marks a URL handed out by `get()` as crawled """
+        self._release(depth)
+        if not self._pending:
+            self._finished.set()
+        self._changed.set()
+
+    async def join(self):
+        """ Waits until all URLs have been crawled """
+        await self._finished.wait()
+
+
+class FrontierCheckpoint:
+    """
+    Persists the crawl frontier (pending URLs and their depth) and the set of visited URLs
+    in `./.microwler/frontier/<domain>`, so an interrupted crawl can be resumed.
+
+    > Changes are buffered and written in a single transaction once `interval` changes
+    > have been collected, so checkpointing does not slow down the crawl.
+    """
+
+    def __init__(self, domain: str, interval: int = 500):
+        """
+        Arguments:
+            domain: the domain of the crawler
+            interval: the number of changes to collect before writing them to disk
+        """
+        from diskcache import Cache
+        self._store = Cache(f'./.microwler/frontier/{domain}')
+        self._interval = interval
+        self._ops = []
+
+    def load(self):
+        """ Returns the visited URLs and the pending `(url, depth)` pairs of an interrupted crawl """
+        seen, pending = set(), []
+        for key in self._store.iterkeys():
+            kind, url = key.split(':', 1)
+            if kind == 's':
+                seen.add(url)
+            else:
+                pending.append((url, self._store[key]))
+        return seen, pending
+
+    def seen(self, url: str):
+        self._add(('s', url, None))
+
+    def queued(self, url: str, depth: int):
+        self._add(('p', url, depth))
+
+    def done(self, url: str):
+        self._add(('d', url, None))
+
+    def _add(self, op):
+        self._ops.append(op)
+        if len(self._ops) >= self._interval:
+            self.flush()
+
+    def flush(self):
+        """ Writes buffered changes to disk, keeping their order """
+        if not self._ops:
+            return
+        with self._store.transact():
+            for kind, url, depth in self._ops:
+                if kind == 's':
+                    self._store[f's:{url}'] = 1
+                elif kind == 'p':
+                    self._store[f'p:{url}'] = depth
+                else:
+                    self._store.delete(f'p:{url}')
+        # only drop the buffer once it has been written, i.e. in case of interrupts
+        self._ops = []
+
+    def clear(self):
+        """ Removes the checkpoint, i.e. after the crawl finished """
+        self._ops = []
+        self._store.clear()
+
+    def close(self):
+        self._store.close()
@@ -0,0 +1,168 @@
+import bisect
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from aiohttp import TraceConfig
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class Histogram:
+    """ Histogram with fixed buckets (in seconds), so recording a value is just a bisect and two additions """
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, share: float):
+        """ Returns the upper bound of the bucket containing the given quantile """
+        if not self.count:
+            return None
+        rank, total = share * self.count, 0
+        for bound, count in zip(BUCKETS, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return BUCKETS[-1]
+
+
+class Metrics:
+    """
+    Timers and counters for the stages of a crawl. Stage timings (in seconds) are recorded
+    in histograms, i.e. `dns`, `connect`, `wait` (politeness scheduler), `download`, `parse`,
+    `scrape`, `cache` and `export`. Counters track pages, requests, retries, errors and downloaded bytes,
+    gauges track the frontier's queue depth and requests in flight.
+    """
+
+    def __init__(self):
+        self.histograms = defaultdict(Histogram)
+        self.counters = Counter()
+        self.gauges = Counter()
+
+    def observe(self, stage: str, seconds: float):
+        self.histograms[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histograms[stage].observe(time.perf_counter() - start)
+
+    def inc(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def gauge(self, name: str, value: float = None, delta: float = None):
+        """ Sets a gauge to `value` or changes it by `delta` """
+        if value is not None:
+            self.gauges[name] = value
+        else:
+            self.gauges[name] += delta
+
+    def merge(self, other: 'Metrics'):
+        """ Adds the histograms and counters of another instance, i.e. to aggregate many crawlers """
+        for stage, histogram in other.histograms.items():
+            own = self.histograms[stage]
+            own.counts = [a + b for a, b in zip(own.counts, histogram.counts)]
+            own.sum += histogram.sum
+            own.count += histogram.count
+        self.counters.update(other.counters)
+        return self
+
+    def snapshot(self):
+        """ Returns the current metrics as `dict` """
+        return {
+            'stages': {
+                stage: {
+                    'count': histogram.count,
+                    'sum': round(histogram.sum, 6),
+                    'p50': histogram.quantile(0.5),
+                    'p99': histogram.quantile(0.99),
+                }
+                for stage, histogram in self.histograms.items()
+            },
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+        }
+
+    def to_prometheus(self, labels: dict = None, prefix: str = 'microwler'):
+        """ Renders the metrics in the Prometheus text exposition format """
+        return to_prometheus([(labels, self)], prefix=prefix)
+
+
+def _labels(*pairs):
+    return ','.join(f'{key}="{value}"' for labels in pairs for key, value in (labels or {}).items())
+
+
+def to_prometheus(instances: list, prefix: str = 'microwler'):
+    """
+    Renders several `Metrics` instances in the Prometheus text exposition format, i.e. those of many projects.
+    Expects `(labels, metrics)` pairs and writes each metric family once, with a sample per instance.
+    """
+    histograms, counters, gauges = defaultdict(list), defaultdict(list), defaultdict(list)
+    for labels, metrics in instances:
+        for stage, histogram in metrics.histograms.items():
+            histograms[f'{prefix}_stage_seconds'].append((_labels(labels, {'stage': stage}), histogram))
+        for name, value in metrics.counters.items():
+            counters[f'{prefix}_{name}_total'].append((_labels(labels), value))
+        for name, value in metrics.gauges.items():
+            gauges[f'{prefix}_{name}'].append((_labels(labels), value))
+
+    lines = []
+    for family, samples in histograms.items():
+        lines.append(f'# TYPE {family} histogram')
+        for labels, histogram in samples:
+            total = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                total += count
+                le = '+Inf' if bound == float('inf') else bound
+                lines.append(f'{family}_bucket{{{labels},le="{le}"}} {total}')
+            lines.append(f'{family}_sum{{{labels}}} {histogram.sum}')
+            lines.append(f'{family}_count{{{labels}}} {histogram.count}')
+    for kind, families in (('counter', counters), ('gauge', gauges)):
+        for family, samples in families.items():
+            lines.append(f'# TYPE {family} {kind}')
+            for labels, value in samples:
+                lines.append(f'{family}{{{labels}}} {value}' if labels else f'{family} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def trace_config():
+    """
+    Returns an `aiohttp.TraceConfig` which records DNS, connection and download metrics.
+    The `Metrics` instance is passed with each request as `trace_request_ctx`, so one session can serve many crawlers.
+    """
+
+    async def on_dns_start(session, context, params):
+        context.dns_start = time.perf_counter()
+
+    async def on_dns_end(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx.observe('dns', time.perf_counter() - context.dns_start)
+
+    async def on_connect_start(session, context, params):
+        context.connect_start = time.perf_counter()
+
+    async def on_connect_end(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx.observe('connect', time.perf_counter() - context.connect_start)
+
+    async def on_chunk(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx.counters['bytes_downloaded'] += len(params.chunk)
+
+    trace = TraceConfig()
+    trace.on_dns_resolvehost_start.append(on_dns_start)
+    trace.on_dns_resolvehost_end.append(on_dns_end)
+    trace.on_connection_create_start.append(on_connect_start)
+    trace.on_connection_create_end.append(on_connect_end)
+    trace.on_response_chunk_received.append(on_chunk)
+    return trace
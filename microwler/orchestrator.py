@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from microwler import client
+from microwler.metrics import Metrics
+from microwler.scheduler import FairBudget
+from microwler.utils import load_project, PROJECT_FOLDER
+
+LOG = logging.getLogger(__name__)
+
+
+def list_projects(project_folder: str = None):
+    """ Returns the names of all projects in the given folder """
+    folder = project_folder or PROJECT_FOLDER
+    return sorted(path[:-3] for path in os.listdir(folder) if path.endswith('.py'))
+
+
+class Orchestrator:
+    """
+    Runs many projects concurrently on one event loop. All crawlers share a global budget of requests in flight,
+    which is handed out fairly across domains (see `microwler.scheduler.FairBudget`), and their connection pools.
+
+    > Use `crawl_all()` to spread the projects across several processes.
+    """
+
+    def __init__(self, projects: list = None, project_folder: str = None,
+                 max_requests: int = 100, max_projects: int = 10, keep_source: bool = False):
+        """
+        Arguments:
+            projects: names of the projects to run, defaults to all projects in the project folder
+            project_folder: the folder containing the projects, defaults to `${CWD}/projects`
+            max_requests: the number of requests in flight across all projects
+            max_projects: the number of projects crawled at the same time
+            keep_source: keep the HTML source of crawled pages
+        """
+        self.project_folder = project_folder or PROJECT_FOLDER
+        self.projects = projects if projects is not None else list_projects(self.project_folder)
+        self.max_requests = max_requests
+        self.max_projects = max_projects
+        self.keep_source = keep_source
+        self.stats = dict()
+        self.metrics = Metrics()
+
+    async def _run_project(self, name: str, budget: FairBudget, running: asyncio.Semaphore):
+        async with running:
+            start = time.perf_counter()
+            try:
+                crawler = load_project(name, self.project_folder).crawler
+                crawler._budget = budget
+                await crawler.run_async(asyncio.get_event_loop(), keep_source=self.keep_source)
+            except Exception as e:
+                LOG.error(f'Project failed: {e} [{name}]')
+                self.stats[name] = {'pages': 0, 'errors': 0, 'seconds': round(time.perf_counter() - start, 3),
+                                    'failed': str(e)}
+                return
+            self.stats[name] = {
+                'pages': len(crawler._results),
+                'errors': len(crawler.errors),
+                'seconds': round(time.perf_counter() - start, 3),
+            }
+            self.metrics.merge(crawler.metrics)
+
+    async def run_async(self):
+        """ Runs all projects on the running event loop and returns the aggregated stats """
+        budget = FairBudget(self.max_requests)
+        running = asyncio.Semaphore(self.max_projects)
+        start = time.perf_counter()
+        await asyncio.gather(*(self._run_project(name, budget, running) for name in self.projects))
+        return self.report(time.perf_counter() - start)
+
+    def run(self):
+        """ Runs all projects and returns the aggregated stats """
+        loop = client.event_loop()
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(self.run_async())
+
+    def report(self, seconds: float):
+        return summarize(self.stats, self.metrics, seconds)
+
+
+def summarize(stats: dict, metrics: Metrics, seconds: float):
+    """ Aggregates the stats of many projects """
+    pages = sum(project['pages'] for project in stats.values())
+    return {
+        'projects': stats,
+        'pages': pages,
+        'errors': sum(project['errors'] for project in stats.values()),
+        'failed': sorted(name for name, project in stats.items() if 'failed' in project),
+        'seconds': round(seconds, 3),
+        'pages_per_second': round(pages / seconds, 1) if seconds else None,
+        'metrics': metrics.snapshot(),
+    }
+
+
+def _run_shard(kwargs: dict):
+    orchestrator = Orchestrator(**kwargs)
+    orchestrator.run()
+    # worker processes skip `atexit` handlers
+    client.event_loop().run_until_complete(client.close_sessions())
+    return orchestrator.stats, orchestrator.metrics
+
+
+def crawl_all(projects: list = None, project_folder: str = None, workers: int = 1,
+              max_requests: int = 100, max_projects: int = 10, keep_source: bool = False):
+    """
+    Runs many projects, sharded across `workers` processes with one `Orchestrator` each.
+    The request budget is split evenly between the processes. Returns the aggregated stats.
+    """
+    projects = projects if projects is not None else list_projects(project_folder)
+    workers = max(1, min(workers, len(projects)))
+    if workers == 1:
+        return Orchestrator(projects, project_folder, max_requests, max_projects, keep_source).run()
+
+    start = time.perf_counter()
+    shards = [
+        {'projects': projects[i::workers], 'project_folder': project_folder,
+         'max_requests': max(1, max_requests // workers), 'max_projects': max_projects, 'keep_source': keep_source}
+        for i in range(workers)
+    ]
+    stats, metrics = dict(), Metrics()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard_stats, shard_metrics in executor.map(_run_shard, shards):
+            stats.update(shard_stats)
+            metrics.merge(shard_metrics)
+    return summarize(stats, metrics, time.perf_counter() - start)
@@ -1,10 +1,13 @@
 import datetime
 import logging
+import os
+import time
+import zlib
+from functools import lru_cache
 
-from lxml.etree import ParserError
-from parsel import Selector
+from lxml.etree import ParserError, XPath
 
-from microwler.utils import get_first_or_list
+from microwler.utils import compile_xpath, get_first_or_list, load_project, parse_html, stringify
 
 
 LOG = logging.getLogger(__name__)
@@ -16,50 +19,115 @@ class Page(object):
 
     > The methods `scrape()` and `transform()` will be called by the crawler instance
     > if selectors and a corresponding transformer function are defined.
+
+    The HTML body is kept as (optionally compressed) bytes and only decoded when `Page.html` is accessed.
+    Use `to_dict()` and `from_dict()` for serialization.
     """
 
-    def __init__(self, url: str, status_code: int, depth: int, links: list = None, html: bytes = None):
+    __slots__ = ('url', 'discovered', 'status_code', 'depth', 'links', 'data', '_body', '_compressed', '_encoding')
+
+    def __init__(self, url: str, status_code: int, depth: int, links: list = None, html=None,
+                 compress: bool = False, encoding: str = 'utf-8'):
         """
         Arguments:
             url: the URL of this page
             status_code: the request's getStatus code
             depth: the depth at which this page was crawled
             links: list of internal links found on this page
-            html: HTML body
+            html: HTML body as `str` or `bytes`
+            compress: keep the HTML body compressed in memory
+            encoding: the encoding of `html` if given as `bytes`
         """
         self.url = url
         self.discovered = datetime.date.today().strftime('%Y-%m-%d')
         self.status_code = status_code
         self.depth = depth
         self.links = links
-        self.html = html
         self.data = {}
+        self._compressed = compress
+        self._encoding = encoding
+        self._body = None
+        if html is not None:
+            self.set_source(html, encoding)
+
+    @property
+    def html(self):
+        """ The decoded HTML body or `None` if it has been dropped """
+        if self._body is None:
+            return None
+        body = zlib.decompress(self._body) if self._compressed else self._body
+        return body.decode(self._encoding, errors='replace')
+
+    def set_source(self, html, encoding: str = 'utf-8'):
+        """ Stores the HTML body, given as `str` or as `bytes` in the given encoding """
+        if isinstance(html, str):
+            html, encoding = html.encode('utf-8'), 'utf-8'
+        self._encoding = encoding
+        self._body = zlib.compress(html, 1) if self._compressed else html
+
+    def to_dict(self):
+        """ Returns the `dict` representation of this page, which is used for results, exports and caching """
+        entry = {
+            'url': self.url,
+            'discovered': self.discovered,
+            'status_code': self.status_code,
+            'depth': self.depth,
+            'links': self.links,
+        }
+        if self._body is not None:
+            entry['html'] = self.html
+        entry['data'] = self.data
+        return entry
 
-    def scrape(self, selectors: dict, keep_source=False):
+    @classmethod
+    def from_dict(cls, data: dict, compress: bool = False):
+        """ Restores a page from its `dict` representation, i.e. a cache entry """
+        page = cls(data['url'], data['status_code'], data['depth'], data.get('links'), data.get('html'), compress)
+        page.discovered = data.get('discovered', page.discovered)
+        page.data = data.get('data') or {}
+        return page
+
+    def scrape(self, selectors: dict, keep_source=False, dom=None):
         """
-        Extracts data using the given selectors. Selectors are either `XPaths` (strings) or callables.
-        If a callable is given, it will receive the parsed DOM as only argument,
+        Extracts data using the given selectors. Selectors are either `XPaths` (strings or compiled `lxml.etree.XPath`)
+        or callables. If a callable is given, it will receive the parsed DOM as only argument,
         which is a [Parsel selector](https://parsel.readthedocs.io/en/latest/usage.html#using-selectors) instance.
         This means you can apply `dom.xpath(...)` or `dom.css(...)` and return any native Python datatype you want.
 
         > Note: The selected data items will be stored in `Page.data`, which is a Python `dict`
+
+        Arguments:
+            selectors: a `dict` of selectors, see above
+            keep_source: keep the HTML body after scraping
+            dom: the page's already parsed `lxml` tree (optional), so the HTML is not parsed twice
         """
 
         try:
-            dom = Selector(text=self.html)
-            for field, selector in selectors.items():
-                if type(selector) == str:
-                    self.data[field] = get_first_or_list(dom.xpath(selector))
+            root = dom if dom is not None else parse_html(self.html)
+            selector = None
+            for field, select in selectors.items():
+                if type(select) == str:
+                    select = compile_xpath(select)
+                if isinstance(select, XPath):
+                    self.data[field] = get_first_or_list(stringify(select(root)))
                 else:
-                    self.data[field] = selector(dom)
+                    # callables get a Parsel selector, built only once per page
+                    if selector is None:
+                        from parsel import Selector
+                        selector = Selector(root=root)
+                    self.data[field] = select(selector)
         except ParserError as e:
             LOG.warning(f'Parsing error: {e}')
 
         if not keep_source:
-            del self.html
+            self.drop_source()
 
         return self
 
+    def drop_source(self):
+        """ Discard the HTML body of this page """
+        self._body = None
+
     def transform(self, func):
         """
         Applies a given function to this page's data.
@@ -78,3 +146,33 @@ class Page(object):
                 LOG.warning(f'Transformer error: {e}')
                 return self
         raise ValueError('You need to provide selectors in order to use a transformer')
+
+
+@lru_cache(maxsize=None)
+def _project_callables(path: str):
+    """ Imports a project module once per worker process and returns its crawler's selectors and transformer """
+    folder, filename = os.path.split(path)
+    crawler = load_project(os.path.splitext(filename)[0], folder).crawler
+    return crawler._selectors, crawler._transformer
+
+
+def scrape_chunk(task, pages: list):
+    """
+    Scrapes and transforms a chunk of pages in a worker process, see the `scrape_pool` setting.
+
+    Arguments:
+        task: either a tuple `(selectors, transformer)` or the path of the project module which defines them
+        pages: a list of `Page` objects, their HTML bodies are sent as they are (i.e. compressed)
+
+    Returns:
+        a list of `(data, seconds)` tuples, one per page
+    """
+    selectors, transformer = _project_callables(task) if isinstance(task, str) else task
+    results = []
+    for page in pages:
+        start = time.perf_counter()
+        page.scrape(selectors)
+        if transformer is not None:
+            page.transform(transformer)
+        results.append((page.data, time.perf_counter() - start))
+    return results
@@ -0,0 +1,244 @@
+import asyncio
+import random
+import time
+from collections import Counter, deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+def parse_retry_after(value: str):
+    """ Returns the delay in seconds given by a `Retry-After` header (seconds or HTTP date) """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """ Limits the request rate to `rate` requests per second, allowing bursts of up to `burst` requests """
+
+    def __init__(self, rate: float = None, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    def pause(self, seconds: float):
+        """ Blocks all requests for the given time, i.e. as requested by a `Retry-After` header """
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            if not self.rate:
+                return
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit which adapts to the server (AIMD): it grows by one request per round trip
+    while responses are fast and successful, and is cut in half on errors or slow responses.
+    """
+
+    def __init__(self, maximum: int, latency_target: float, minimum: int = 1):
+        self.limit = float(maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self._active = 0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+
+    async def acquire(self):
+        while self._active >= int(self.limit):
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self._active += 1
+
+    def release(self, latency: float, failed: bool):
+        self._active -= 1
+        now = time.monotonic()
+        if failed or latency > self.latency_target:
+            # decrease at most once per round trip, requests in flight saw the same conditions
+            if now - self._last_decrease > latency:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._last_decrease = now
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        free = int(self.limit) - self._active
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class FairBudget:
+    """
+    Global limit of requests in flight, shared by many crawlers (see `microwler.orchestrator`).
+    Whenever a request finishes, the free slot goes to the waiting host with the fewest requests in flight,
+    so large sites cannot starve small ones.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._active = 0
+        self._in_flight = Counter()
+        self._waiters = dict()
+
+    async def acquire(self, key: str):
+        if self._active < self.limit and not self._waiters:
+            self._grant(key)
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over already
+                self.release(key)
+            else:
+                queue = self._waiters.get(key)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._waiters[key]
+            raise
+
+    def _grant(self, key: str):
+        self._active += 1
+        self._in_flight[key] += 1
+
+    def release(self, key: str):
+        self._active -= 1
+        self._in_flight[key] -= 1
+        if not self._in_flight[key]:
+            del self._in_flight[key]
+        while self._active < self.limit and self._waiters:
+            key = min(self._waiters, key=lambda host: self._in_flight[host])
+            queue = self._waiters[key]
+            waiter = queue.popleft()
+            if not queue:
+                del self._waiters[key]
+            if not waiter.done():
+                self._grant(key)
+                waiter.set_result(None)
+
+
+class _Slot:
+    def __init__(self, host: 'HostState'):
+        self._host = host
+        self._start = 0.0
+        self.failed = False
+
+    async def __aenter__(self):
+        await self._host.bucket.acquire()
+        if self._host.limiter is not None:
+            await self._host.limiter.acquire()
+        if self._host.budget is not None:
+            await self._host.budget.acquire(self._host.name)
+        self._start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._host.budget is not None:
+            self._host.budget.release(self._host.name)
+        if self._host.limiter is not None:
+            self._host.limiter.release(time.monotonic() - self._start, self.failed or exc_type is not None)
+
+
+class HostState:
+    def __init__(self, name: str, bucket: TokenBucket, limiter: AdaptiveLimiter = None, budget: FairBudget = None):
+        self.name = name
+        self.bucket = bucket
+        self.limiter = limiter
+        self.budget = budget
+
+
+class HostScheduler:
+    """
+    Politeness per host: a token bucket for the request rate, optional adaptive concurrency
+    and bounded exponential backoff which respects `Retry-After` headers.
+    """
+
+    def __init__(self, rate_limit: float = None, burst: int = 1, adaptive: bool = False,
+                 max_concurrency: int = 20, latency_target: float = 2.0,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0, budget: FairBudget = None):
+        self._rate_limit = rate_limit
+        self._burst = burst
+        self._adaptive = adaptive
+        self._max_concurrency = max_concurrency
+        self._latency_target = latency_target
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._budget = budget
+        self._hosts = dict()
+
+    @classmethod
+    def from_settings(cls, settings, budget: FairBudget = None):
+        return cls(
+            rate_limit=settings.rate_limit, burst=settings.rate_burst, adaptive=settings.adaptive_concurrency,
+            max_concurrency=settings.max_concurrency, latency_target=settings.latency_target,
+            backoff_base=settings.backoff_base, backoff_max=settings.backoff_max, budget=budget,
+        )
+
+    def host(self, url: str) -> HostState:
+        netloc = urlparse(url).netloc
+        if netloc not in self._hosts:
+            limiter = AdaptiveLimiter(self._max_concurrency, self._latency_target) if self._adaptive else None
+            self._hosts[netloc] = HostState(netloc, TokenBucket(self._rate_limit, self._burst), limiter, self._budget)
+        return self._hosts[netloc]
+
+    def slot(self, url: str):
+        """ Async context manager which waits for the host's rate limit, its concurrency limit and the global budget """
+        return _Slot(self.host(url))
+
+    def crawl_delay(self, url: str, seconds: float):
+        """ Applies a `Crawl-delay` from `robots.txt` to the host, unless its rate limit is stricter already """
+        if not seconds or seconds <= 0:
+            return
+        bucket = self.host(url).bucket
+        rate = 1 / seconds
+        if not bucket.rate or rate < bucket.rate:
+            bucket.rate = rate
+            bucket.capacity = 1
+            bucket._tokens = min(bucket._tokens, 1)
+
+    def backoff(self, url: str, attempt: int, retry_after: str = None):
+        """
+        Returns the delay before the next attempt. A `Retry-After` header pauses the whole host.
+        """
+        delay = parse_retry_after(retry_after)
+        if delay is not None:
+            delay = min(delay, self._backoff_max)
+            self.host(url).bucket.pause(delay)
+            return delay
+        delay = min(self._backoff_max, self._backoff_base * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
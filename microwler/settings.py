@@ -1,19 +1,72 @@
 import logging
 import os
+from typing import Callable
 
 LOG = logging.getLogger(__name__)
 
 
 class Settings(object):
     link_filter: str = '//a/@href'
+    include_urls: list = None
+    exclude_urls: list = None
+    strip_params: list = ['utm_*', 'gclid', 'fbclid', 'msclkid', 'mc_cid', 'mc_eid', 'jsessionid', 'phpsessid', 'sessionid']
+    ignored_extensions: list = None
+    url_cache_size: int = 100000
     max_depth: int = 10
     max_concurrency: int = 20
+    rate_limit: float = None
+    rate_burst: int = 1
+    adaptive_concurrency: bool = False
+    latency_target: float = 2.0
+    max_retries: int = 2
+    backoff_base: float = 0.5
+    backoff_max: float = 30.0
+    allowed_content_types: list = ['text/html', 'application/xhtml+xml']
+    max_body_size: int = 10 * 1024 * 1024
+    parser_pool: str = None
+    parser_workers: int = None
+    scrape_pool: bool = False
+    scrape_workers: int = None
+    scrape_chunk_size: int = 100
+    visited_set: str = 'exact'
+    visited_capacity: int = 100000
+    bloom_error_rate: float = 0.001
+    store_links: str = 'full'
     dns_providers: list = ['1.1.1.1', '8.8.8.8']
+    dns_cache_ttl: int = 300
+    connection_limit: int = 100
+    connection_limit_per_host: int = 0
+    keepalive_timeout: float = 15.0
     language: str = 'en-us'
+    sitemaps: bool = False
+    respect_robots: bool = False
+    robots_ttl: int = 86400
+    max_sitemaps: int = 1000
     caching: bool = False
+    cache_compression: str = 'zlib'
+    cache_ttl: float = None
+    cache_size_limit: int = 2 ** 30
+    cache_eviction: str = 'least-recently-stored'
+    cache_batch_size: int = 500
     delta_crawl: bool = False
+    revalidate: bool = False
+    skip_unchanged: bool = False
+    dedup_content: bool = False
+    streaming: bool = False
+    compress_source: bool = True
+    resumable: bool = False
+    checkpoint_interval: int = 500
+    distributed: bool = False
+    distributed_backend: str = None
+    shard: int = 0
+    shards: int = 1
     export_to = os.path.join(os.getcwd(), 'exports')
     exporters: list = []
+    metrics_hook: Callable[[dict], None] = None
+    metrics_interval: float = 10.0
+    export_batch_size: int = 500
+    export_compression: str = None
+    export_changed_only: bool = False
 
     def __init__(self, params: dict):
         if params:
@@ -23,3 +76,15 @@ class Settings(object):
             if self.delta_crawl and not self.caching:
                 self.caching = True
                 LOG.info('Auto-enabled caching (required for delta_crawl)')
+
+            if self.revalidate and not self.caching:
+                self.caching = True
+                LOG.info('Auto-enabled caching (required for revalidate)')
+
+            if self.skip_unchanged and not self.caching:
+                self.caching = True
+                LOG.info('Auto-enabled caching (required for skip_unchanged)')
+
+            if self.revalidate and self.store_links != 'full':
+                # a 304 response has no body, so the links of the page can only come from the cache
+                raise ValueError('revalidate requires store_links="full" to follow the links of unchanged pages')
@@ -0,0 +1,89 @@
+"""
+Canonicalization and filtering of discovered links. The rules are compiled once per crawler and the results
+are memoized, because the same navigation and footer links show up on every page of a site.
+"""
+import re
+from fnmatch import translate
+from functools import lru_cache
+from urllib.parse import urlparse, urlencode, parse_qsl
+
+# Mostly copied from scrapy.contrib.linkextractor
+IGNORED_EXTENSIONS = [
+    # images
+    'mng', 'pct', 'bmp', 'gif', 'jpg', 'jpeg', 'png', 'pst', 'psp', 'tif',
+    'tiff', 'ai', 'drw', 'dxf', 'eps', 'ps', 'svg',
+
+    # audio
+    'mp3', 'wma', 'ogg', 'wav', 'ra', 'aac', 'mid', 'au', 'aiff',
+
+    # video
+    '3gp', 'asf', 'asx', 'avi', 'mov', 'mp4', 'mpg', 'qt', 'rm', 'swf', 'wmv', 'm4a',
+
+    # other
+    'css', 'pdf', 'doc', 'docx', 'xls', 'xlsx', 'dmg', 'exe', 'bin', 'rss', 'zip', 'rar',
+]
+
+
+def _any_of(patterns, flags=0):
+    """ Combines several regexes into one """
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns), flags)
+
+
+class URLFilter:
+    """
+    Normalizes and filters links with precompiled rules. Results are kept in bounded LRU caches.
+    """
+
+    def __init__(self, include: list = None, exclude: list = None, strip_params: list = None,
+                 ignored_extensions: list = None, cache_size: int = 100000):
+        """
+        Arguments:
+            include: regexes, links must match at least one of them (if given)
+            exclude: regexes, links matching any of them are dropped
+            strip_params: names of query parameters to remove, may contain wildcards, i.e. `utm_*`
+            ignored_extensions: file extensions to drop, defaults to `IGNORED_EXTENSIONS`
+            cache_size: maximum number of URLs memoized by `normalize()` and `accept()` each
+        """
+        extensions = IGNORED_EXTENSIONS if ignored_extensions is None else ignored_extensions
+        self._extensions = frozenset(extension.lower().lstrip('.') for extension in extensions)
+        self._include = _any_of(include)
+        self._exclude = _any_of(exclude)
+        self._strip = _any_of([translate(name) for name in strip_params or []], re.IGNORECASE)
+        self.normalize = lru_cache(maxsize=cache_size)(self._normalize)
+        self.accept = lru_cache(maxsize=cache_size)(self._accept)
+
+    def _normalize(self, url: str):
+        """ Drops fragments and stripped query parameters and sorts the remaining ones """
+        parsed = urlparse(url)
+        path = parsed.path if parsed.path.startswith('/') else f'/{parsed.path}'
+        query = ''
+        if parsed.query:
+            params = parse_qsl(parsed.query)
+            if self._strip is not None:
+                params = [(name, value) for name, value in params if not self._strip.match(name)]
+            if params:
+                query = '?' + urlencode(sorted(params))
+        return f'{parsed.scheme}://{parsed.netloc}{path}{query}'
+
+    def _accept(self, url: str):
+        """ Checks the file extension and the include/exclude rules """
+        path = url.split('#', 1)[0].split('?', 1)[0]
+        name = path.rsplit('/', 1)[-1]
+        if '.' in name and name.rsplit('.', 1)[-1].lower() in self._extensions:
+            return False
+        if self._include is not None and self._include.search(url) is None:
+            return False
+        if self._exclude is not None and self._exclude.search(url) is not None:
+            return False
+        return True
+
+    def filter(self, links):
+        """ Returns the accepted links """
+        accept = self.accept
+        return [link for link in links if accept(link)]
+
+    def cache_info(self):
+        """ Hit rates of the caches, i.e. to choose `url_cache_size` """
+        return {'normalize': self.normalize.cache_info(), 'accept': self.accept.cache_info()}
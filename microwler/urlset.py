@@ -0,0 +1,140 @@
+import hashlib
+import math
+from array import array
+
+
+def url_hash(url: str, size: int = 8):
+    """ Returns a stable hash of the given URL as `int` with `size` bytes """
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=size).digest(), 'little')
+
+
+class HashedURLSet:
+    """
+    Visited set which keeps 64-bit URL hashes in an open-addressing table backed by an `array`,
+    i.e. 8 bytes per slot instead of a full URL string per entry.
+
+    > Two different URLs with the same 64-bit hash are treated as one,
+    > which is very unlikely below billions of URLs.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        size = 1 << max(10, (capacity * 2 - 1).bit_length())
+        self._table = array('Q', bytes(8 * size))
+        self._mask = size - 1
+        self._count = 0
+
+    def _find(self, value: int):
+        table, mask = self._table, self._mask
+        index = value & mask
+        while True:
+            slot = table[index]
+            if slot == 0 or slot == value:
+                return index
+            index = (index + 1) & mask
+
+    def _grow(self):
+        old = self._table
+        self._table = array('Q', bytes(8 * len(old) * 2))
+        self._mask = len(self._table) - 1
+        for value in old:
+            if value:
+                self._table[self._find(value)] = value
+
+    def add(self, url: str):
+        value = url_hash(url) or 1  # 0 marks empty slots
+        index = self._find(value)
+        if self._table[index] == 0:
+            self._table[index] = value
+            self._count += 1
+            if self._count * 2 > len(self._table):
+                self._grow()
+
+    def update(self, urls):
+        for url in urls:
+            self.add(url)
+
+    def __contains__(self, url: str):
+        value = url_hash(url) or 1
+        return self._table[self._find(value)] == value
+
+    def __len__(self):
+        return self._count
+
+
+class BloomFilter:
+    """ Fixed-size Bloom filter using enhanced double hashing over a `bytearray` """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self._bits_count = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._bits_count / capacity * math.log(2)))
+        self._bits = bytearray((self._bits_count + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest: int):
+        first, second = digest & 0xFFFFFFFFFFFFFFFF, digest >> 64
+        return [(first + i * second + i * i * i) % self._bits_count for i in range(self._hashes)]
+
+    def add(self, digest: int):
+        for position in self._positions(digest):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest: int):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+
+class BloomURLSet:
+    """
+    Scalable Bloom filter as visited set. Whenever the current filter is full, a new one with
+    twice the capacity and half the error rate is added, so the overall false-positive rate
+    stays below `error_rate` no matter how many URLs are added.
+
+    > A false positive means that an unseen URL is considered visited and will not be crawled.
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        self._error_rate = error_rate / 2
+        self._filters = [BloomFilter(capacity, self._error_rate)]
+        self._count = 0
+
+    def add(self, url: str):
+        digest = url_hash(url, 16)
+        if any(digest in bloom for bloom in self._filters):
+            return
+        bloom = self._filters[-1]
+        if bloom.count >= bloom.capacity:
+            self._error_rate /= 2
+            bloom = BloomFilter(bloom.capacity * 2, self._error_rate)
+            self._filters.append(bloom)
+        bloom.add(digest)
+        self._count += 1
+
+    def update(self, urls):
+        for url in urls:
+            self.add(url)
+
+    def __contains__(self, url: str):
+        digest = url_hash(url, 16)
+        return any(digest in bloom for bloom in self._filters)
+
+    def __len__(self):
+        return self._count
+
+
+def make_url_set(kind: str = 'exact', capacity: int = 100000, error_rate: float = 0.001):
+    """
+    Creates the visited set for a crawler
+
+    Arguments:
+        kind: `'exact'` (Python `set`), `'hashed'` (64-bit hashes) or `'bloom'` (scalable Bloom filter)
+        capacity: the number of URLs to expect initially
+        error_rate: the false-positive rate of the Bloom filter
+    """
+    if kind == 'exact':
+        return set()
+    if kind == 'hashed':
+        return HashedURLSet(capacity)
+    if kind == 'bloom':
+        return BloomURLSet(capacity, error_rate)
+    raise ValueError(f'Unknown visited_set: {kind} (expected "exact", "hashed" or "bloom")')
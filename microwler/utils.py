@@ -1,47 +1,49 @@
+import codecs
+import hashlib
 import importlib
 import importlib.util
 import os
+import re
 from datetime import datetime
-from urllib.parse import urlparse, urlencode, parse_qsl
+from functools import lru_cache
+from urllib.parse import urlparse, urlencode, parse_qsl, urljoin
 
-from random_user_agent.user_agent import UserAgent
-from random_user_agent.params import SoftwareName, OperatingSystem
+from microwler.urlfilter import IGNORED_EXTENSIONS, URLFilter
 
 
 PROJECT_FOLDER = os.path.join(os.getcwd(), 'projects')
+# only checks file extensions, crawlers build their own from their settings
+DEFAULT_URL_FILTER = URLFilter()
 
-_software_names = [SoftwareName.CHROME.value]
-_operating_systems = [OperatingSystem.WINDOWS.value, OperatingSystem.LINUX.value]
-UAFactory = UserAgent(software_names=_software_names, operating_systems=_operating_systems, limit=100)
+
+@lru_cache(maxsize=None)
+def _user_agents():
+    """ The pool of user agents, built on first use since loading it takes a while """
+    from random_user_agent.user_agent import UserAgent
+    from random_user_agent.params import SoftwareName, OperatingSystem
+
+    software_names = [SoftwareName.CHROME.value]
+    operating_systems = [OperatingSystem.WINDOWS.value, OperatingSystem.LINUX.value]
+    return UserAgent(software_names=software_names, operating_systems=operating_systems, limit=100)
+
+
+def __getattr__(name):
+    # `UAFactory` used to be built at import time
+    if name == 'UAFactory':
+        return _user_agents()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def get_headers(language: str):
     """ Constructs request headers with given language header and random user-agent """
     return {
-        'User-Agent': UAFactory.get_random_user_agent(),
+        'User-Agent': _user_agents().get_random_user_agent(),
         'Accept-Language': language,
         'Accept-Encoding': 'deflate, gzip;q=1.0, *;q=0.5',
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
     }
 
 
-# Mostly copied from scrapy.contrib.linkextractor
-IGNORED_EXTENSIONS = [
-    # images
-    'mng', 'pct', 'bmp', 'gif', 'jpg', 'jpeg', 'png', 'pst', 'psp', 'tif',
-    'tiff', 'ai', 'drw', 'dxf', 'eps', 'ps', 'svg',
-
-    # audio
-    'mp3', 'wma', 'ogg', 'wav', 'ra', 'aac', 'mid', 'au', 'aiff',
-
-    # video
-    '3gp', 'asf', 'asx', 'avi', 'mov', 'mp4', 'mpg', 'qt', 'rm', 'swf', 'wmv', 'm4a',
-
-    # other
-    'css', 'pdf', 'doc', 'docx', 'xls', 'xlsx', 'dmg', 'exe', 'bin', 'rss', 'zip', 'rar',
-]
-
-
 def norm_url(url: str):
     parsed = urlparse(url)
     # Sort query parameters if there are any
@@ -50,6 +52,112 @@ def norm_url(url: str):
     return f'{parsed.scheme}://{parsed.netloc}{parsed.path if parsed.path.startswith("/") else f"/{parsed.path}"}{query}'
 
 
+@lru_cache(maxsize=None)
+def compile_xpath(xpath: str):
+    """ Compiles an XPath once per process """
+    from lxml import etree
+    return etree.XPath(xpath)
+
+
+def compile_selectors(selectors: dict):
+    """ Compiles XPath selectors, callables are kept as they are """
+    if not selectors:
+        return selectors
+    return {field: compile_xpath(sel) if type(sel) == str else sel for field, sel in selectors.items()}
+
+
+def parse_html(html: str):
+    """ Parses an HTML document into an `lxml` tree """
+    from lxml import html as DOMParser
+    return DOMParser.fromstring(html)
+
+
+def extract_links(html, base_url: str, link_filter, url_filter: URLFilter = None):
+    """
+    Extract relevant links from an HTML document or an already parsed tree, without modifying it.
+    This is a plain function, so it can be sent to a process pool.
+    Links are checked with `url_filter`, which defaults to `DEFAULT_URL_FILTER`.
+    """
+    dom = parse_html(html) if isinstance(html, str) else html
+    xpath = compile_xpath(link_filter) if isinstance(link_filter, str) else link_filter
+    # relative links are resolved against the <base> of the document, if it has one
+    base = dom.find('.//base[@href]')
+    resolve_url = urljoin(base_url, base.get('href').strip()) if base is not None else base_url
+    links = {urljoin(resolve_url, str(link).strip()) for link in xpath(dom)}
+    accept = (url_filter or DEFAULT_URL_FILTER).accept
+    # stay on this website
+    return [link for link in links if link.startswith(base_url) and accept(link)]
+
+
+def stringify(result):
+    """ Converts the result of a compiled XPath to a list of strings, like `parsel.SelectorList.getall()` """
+    from lxml import etree
+    if not isinstance(result, list):
+        result = [result]
+    values = []
+    for item in result:
+        if isinstance(item, etree._Element):
+            values.append(etree.tostring(item, method='html', encoding='unicode', with_tail=False))
+        elif item is True or item is False:
+            values.append('1' if item else '0')
+        else:
+            values.append(str(item))
+    return values
+
+
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_:.-]+)', re.IGNORECASE)
+BOMS = ((codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+# labels which browsers decode as windows-1252, see https://encoding.spec.whatwg.org/
+WINDOWS_1252 = {'iso-8859-1', 'latin-1', 'latin1', 'us-ascii', 'ascii'}
+
+
+def _lookup_encoding(label):
+    if not label:
+        return None
+    label = label.strip().lower()
+    if label in WINDOWS_1252:
+        return 'cp1252'
+    try:
+        return codecs.lookup(label).name
+    except LookupError:
+        return None
+
+
+def _header_charset(content_type: str):
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.partition('=')
+        if key.strip().lower() == 'charset':
+            return value.strip(' "\'')
+    return None
+
+
+def decode_body(body: bytes, content_type: str = None):
+    """
+    Decodes an HTML body without a statistical charset detection. The encoding is taken from the BOM,
+    the charset of the `Content-Type` header or a `<meta>` tag in the first 2 KB. Otherwise UTF-8 is tried,
+    falling back to windows-1252. Returns the text and the encoding.
+    """
+    for bom, encoding in BOMS:
+        if body.startswith(bom):
+            return body.decode(encoding, errors='replace'), encoding
+    encoding = _lookup_encoding(_header_charset(content_type)) if content_type else None
+    if encoding is None:
+        match = META_CHARSET.search(body, 0, 2048)
+        encoding = _lookup_encoding(match.group(1).decode('ascii')) if match else None
+    if encoding is not None:
+        return body.decode(encoding, errors='replace'), encoding
+    try:
+        return body.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        return body.decode('cp1252', errors='replace'), 'cp1252'
+
+
+def fingerprint(html: str):
+    """ Returns a short hash of the normalized document, ignoring whitespace and case """
+    normalized = ' '.join(html.split()).lower()
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).hexdigest()
+
+
 def get_first_or_list(from_result):
     """ Return the first element, if there's only one, otherwise returns the whole list """
     return from_result[0] if (type(from_result) == list and len(from_result) == 1) else from_result
@@ -68,5 +176,8 @@ def load_project(project_name, project_folder=None):
     spec = importlib.util.spec_from_file_location(project_name, path)
     project = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(project)
+    if hasattr(project, 'crawler'):
+        # lets worker processes import the project's selectors and transformer, see `scrape_workers`
+        project.crawler._project_path = path
     return project
 
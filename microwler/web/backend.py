@@ -1,11 +1,15 @@
 import asyncio
+import json
 import logging
 import os
+import time
+import uuid
 from datetime import datetime
 
-from quart import Quart, Response, send_from_directory
+from quart import Quart, Response, request, send_from_directory
 from quart_cors import cors
 
+from microwler.client import close_sessions
 from microwler.utils import load_project, PROJECT_FOLDER
 
 LOG = logging.getLogger(__name__)
@@ -15,6 +19,14 @@ app = cors(app, allow_origin='*')
 
 STATIC = os.path.join(os.path.dirname(__file__), 'frontend/dist')
 PROJECTS = dict()
+METRICS = dict()
+JOBS = dict()
+MAX_JOBS = int(os.environ.get('MICROWLER_MAX_JOBS', 2))  # jobs running at the same time, others are queued
+KEEP_JOBS = 10  # finished jobs to keep in memory
+RESULTS_TTL = 3600  # seconds to keep the results of a finished job, cached data stays available via /data
+MAX_PAGE_SIZE = 1000  # results per response of /data
+_job_slots = None
+_job_tasks = set()
 STATUS = {
     'version': '0.1.8',
     'up_since': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
@@ -37,9 +49,40 @@ async def load_projects():
     LOG.info(f'Imported {len(PROJECTS)} projects from filesystem')
 
 
+def _build_cache_indexes():
+    """ Indexes the caches of earlier versions, so the first request to `/data` does not have to """
+    from microwler.cache import PageCache
+    for name in PROJECTS:
+        try:
+            crawler = load_project(name, PROJECT_FOLDER).crawler
+            if os.path.isdir(f'./.microwler/cache/{crawler._domain}'):
+                cache = PageCache.from_settings(crawler._domain, crawler._settings)
+                try:
+                    cache.build_index()
+                finally:
+                    cache.close()
+        except Exception as e:
+            LOG.warning(f'Could not index cache: {e} [{name}]')
+
+
+def _query_cache(project_name: str, limit: int, cursor: str, filters: dict):
+    crawler = load_project(project_name, project_folder=PROJECT_FOLDER).crawler
+    crawler.set_cache(force=True)
+    return crawler.query_cache(limit=limit, cursor=cursor, **filters)
+
+
 @app.before_serving
 async def init():
     await load_projects()
+    asyncio.get_event_loop().run_in_executor(None, _build_cache_indexes)
+
+
+@app.after_serving
+async def shutdown():
+    for task in list(_job_tasks):
+        task.cancel()
+    await asyncio.gather(*_job_tasks, return_exceptions=True)
+    await close_sessions()
 
 
 @app.route('/status')
@@ -100,6 +143,8 @@ async def crawl(project_name: str):
     """
     Run the project's crawler and return the results
 
+    > For long crawls, use [background jobs][microwler.web.backend.start_job] instead.
+
     - Route: `/crawl/<str:project_name>`
     - Method: `GET`
     - Response example:
@@ -139,6 +184,7 @@ async def crawl(project_name: str):
         loop = asyncio.get_event_loop()
         project.crawler.set_cache(force=True)
         await project.crawler.run_async(event_loop=loop)
+        METRICS[project_name] = project.crawler.metrics
         PROJECTS[project_name]['last_run']['state'] = 'finished successfully'
         return {'data': project.crawler.results}
     except Exception as e:
@@ -147,20 +193,238 @@ async def crawl(project_name: str):
         return Response(str(e), status=500)
 
 
+class Job:
+    """ A crawl running in the background, see `/jobs/<project_name>` """
+
+    def __init__(self, project_name: str):
+        self.id = uuid.uuid4().hex
+        self.project = project_name
+        self.state = 'queued'
+        self.crawler = None
+        self.error = None
+        self.created = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.started = None
+        self.finished = None
+        self.finished_at = None
+        self.progress = {'pages': 0, 'errors': 0, 'queued': 0}
+
+    def release(self):
+        """ Drops the crawler and its results, keeping the progress """
+        if self.crawler is not None:
+            self.progress = self.crawler.progress
+            self.crawler = None
+
+    def status(self):
+        progress = self.crawler.progress if self.crawler is not None else self.progress
+        return {
+            'id': self.id,
+            'project': self.project,
+            'state': self.state,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'error': self.error,
+            **progress,
+        }
+
+
+async def run_job(job: Job):
+    global _job_slots
+    if _job_slots is None:
+        _job_slots = asyncio.Semaphore(MAX_JOBS)
+    async with _job_slots:
+        job.state = 'running'
+        job.started = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        last_run = PROJECTS.setdefault(job.project, {'name': job.project, 'last_run': dict()})['last_run']
+        last_run['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M')
+        try:
+            job.crawler = load_project(job.project, project_folder=PROJECT_FOLDER).crawler
+            job.crawler.set_cache(force=True)
+            await job.crawler.run_async(event_loop=asyncio.get_event_loop())
+            METRICS[job.project] = job.crawler.metrics
+            job.state = 'finished'
+            last_run['state'] = 'finished successfully'
+        except Exception as e:
+            LOG.error(e)
+            job.state = 'failed'
+            job.error = str(e)
+            last_run['state'] = f'failed because: {e}'
+        finally:
+            job.finished = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            job.finished_at = time.monotonic()
+            _forget_old_jobs()
+
+
+def _forget_old_jobs():
+    finished = [job for job in JOBS.values() if job.finished_at is not None]
+    for job in finished[:max(0, len(finished) - KEEP_JOBS)]:
+        del JOBS[job.id]
+    for job in finished:
+        if time.monotonic() - job.finished_at > RESULTS_TTL:
+            job.release()
+
+
+@app.route('/jobs/<project_name>', methods=['POST'])
+async def start_job(project_name: str):
+    """
+    Start the project's crawler in the background and return the job
+
+    - Route: `/jobs/<str:project_name>`
+    - Method: `POST`
+    - Response status: `202 Accepted`
+    - Response example (see [below][microwler.web.backend.job]):
+    ```json
+    {
+        id: "3f7c0c1d9e2a4b6f8a1b2c3d4e5f6a7b",
+        project: "quotes",
+        state: "queued",
+        ...
+    }
+    ```
+
+    > Up to `MICROWLER_MAX_JOBS` (environment variable, default 2) jobs run at the same time, others are queued.
+    """
+    if not os.path.exists(os.path.join(PROJECT_FOLDER, project_name + '.py')):
+        return Response(f'Project "{project_name}" does not exist', status=404)
+    job = Job(project_name)
+    JOBS[job.id] = job
+    _forget_old_jobs()
+    # keep a reference, the event loop only holds weak references to tasks
+    task = asyncio.ensure_future(run_job(job))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    return job.status(), 202, {'Location': f'/jobs/{job.id}'}
+
+
+@app.route('/jobs')
+async def jobs():
+    """
+    Return all known jobs
+
+    - Route: `/jobs`
+    - Method: `GET`
+    """
+    return {'jobs': [job.status() for job in JOBS.values()]}
+
+
+@app.route('/jobs/<job_id>')
+async def job(job_id: str):
+    """
+    Return the state and progress of a job
+
+    - Route: `/jobs/<str:job_id>`
+    - Method: `GET`
+    - Response example:
+    ```json
+    {
+        id: "3f7c0c1d9e2a4b6f8a1b2c3d4e5f6a7b",
+        project: "quotes",
+        state: "running",
+        created: "2021-02-05 17:47:01",
+        started: "2021-02-05 17:47:01",
+        finished: null,
+        error: null,
+        pages: 113,
+        errors: 0,
+        queued: 58
+    }
+    ```
+    """
+    if job_id not in JOBS:
+        return Response('Unknown job', status=404)
+    return JOBS[job_id].status()
+
+
+@app.route('/jobs/<job_id>/results')
+async def job_results(job_id: str):
+    """
+    Stream the results of a finished job as newline-delimited JSON, one page per line
+
+    - Route: `/jobs/<str:job_id>/results`
+    - Method: `GET`
+    - Content type: `application/x-ndjson`
+    - Every line has the same format as the items of `data` [above][microwler.web.backend.crawl]
+
+    > Results are kept for `RESULTS_TTL` seconds after the job finished (`410 Gone` afterwards).
+    """
+    _forget_old_jobs()
+    if job_id not in JOBS:
+        return Response('Unknown job', status=404)
+    job = JOBS[job_id]
+    if job.state != 'finished':
+        return Response(f'Job is {job.state}', status=409)
+    if job.crawler is None:
+        return Response(f'Results have expired, use /data/{job.project}', status=410)
+    crawler = job.crawler
+
+    async def lines():
+        for page in crawler.iter_results():
+            yield json.dumps(page) + '\n'
+
+    return Response(lines(), content_type='application/x-ndjson')
+
+
 @app.route('/data/<project_name>')
 async def data(project_name: str):
     """
-    Return the project's cached data
+    Return the project's cached data, one page of results at a time
 
     - Route: `/data/<str:project_name>`
     - Method: `GET`
-    - Response is in the same format as [above][microwler.web.backend.crawl]
+    - Query parameters (all optional):
+        - `limit`: number of results, up to `MAX_PAGE_SIZE` (default 100)
+        - `cursor`: the `cursor` of the previous response, to get the next results
+        - `status`, `depth`: only pages with this status code or depth
+        - `since`, `until`: only pages discovered on or after/before this date (`YYYY-MM-DD`)
+        - `prefix`: only URLs starting with this prefix
+    - Response is in the same format as [above][microwler.web.backend.crawl], with an additional
+      `cursor` for the next results (`null` on the last page)
+
+    > Caches written by earlier versions are indexed in the background when the service starts.
+    """
+    args = request.args
+    try:
+        limit = min(int(args.get('limit', 100)), MAX_PAGE_SIZE)
+        filters = {
+            'status_code': int(args['status']) if 'status' in args else None,
+            'depth': int(args['depth']) if 'depth' in args else None,
+            'discovered_since': args.get('since'),
+            'discovered_until': args.get('until'),
+            'prefix': args.get('prefix'),
+        }
+        if limit < 1:
+            raise ValueError('limit must be positive')
+    except ValueError as e:
+        return Response(f'Invalid query: {e}', status=400)
+    try:
+        # entries are read and decompressed in a thread, so they don't block the event loop
+        entries, cursor = await asyncio.get_event_loop().run_in_executor(
+            None, _query_cache, project_name, limit, args.get('cursor'), filters
+        )
+    except ValueError as e:
+        return Response(str(e), status=400)
+    return {'data': entries, 'cursor': cursor}
+
+
+@app.route('/metrics')
+async def metrics():
+    """
+    Return the metrics of each project's last run in the Prometheus text format
+
+    - Route: `/metrics`
+    - Method: `GET`
+    - Response example:
+    ```
+    # TYPE microwler_stage_seconds histogram
+    microwler_stage_seconds_bucket{project="quotes",stage="download",le="0.1"} 42
+    ...
+    # TYPE microwler_pages_total counter
+    microwler_pages_total{project="quotes"} 213
+    ```
     """
-    project = load_project(project_name, project_folder=PROJECT_FOLDER)
-    project.crawler.set_cache(force=True)
-    cache = project.crawler.cache
-    response = {'data': cache}
-    return response
+    from microwler.metrics import to_prometheus
+    text = to_prometheus([({'project': name}, m) for name, m in METRICS.items()])
+    return Response(text, content_type='text/plain; version=0.0.4')
 
 
 @app.route('/<folder>/<file>', methods=['GET'])
@@ -38,6 +38,7 @@ setup(
     new=microwler.cli.cmd:add_project
     crawler=microwler.cli.cmd:crawler
     serve=microwler.cli.cmd:start_server
+    crawl-all=microwler.cli.cmd:crawl_all
     ''',
     project_urls={
         'Issues': 'https://github.com/INNOVINATI/microwler/issues',
@@ -5,10 +5,82 @@ which can also be viewed as examples for using the framework.
 Some future version will have a more sophisticated test suite, i.e.
 by integrating tests for the webservice.
 """
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+
 import pytest
 
-from microwler import Microwler, scrape
-from microwler.export import JSONExporter, HTMLExporter
+from benchmarks.fake_site import FakeSite, free_port, start_in_process
+from benchmarks.import_time import measure as measure_imports
+from microwler import Microwler, client, discovery, scrape, utils
+from microwler.distributed import SQLiteBackend, crawl_distributed, make_backend, reset, run_worker, shard_of
+from microwler.cache import PageCache
+from microwler.frontier import FrontierCheckpoint
+from microwler.export import FileExporter, JSONExporter, HTMLExporter, JSONLinesExporter, CSVExporter, ParquetExporter, \
+    ArrowExporter
+from microwler.metrics import Metrics, to_prometheus
+from microwler.orchestrator import Orchestrator, crawl_all
+from microwler.page import Page
+from microwler.scheduler import AdaptiveLimiter, FairBudget, parse_retry_after
+from microwler.settings import Settings
+from microwler.urlfilter import URLFilter
+from microwler.urlset import make_url_set
+
+
+@pytest.fixture(scope='module')
+def fake_site():
+    """ Serves a synthetic website with 50 pages locally """
+    process, url = start_in_process(FakeSite(pages=50, fanout=3, page_kb=1, latency_ms=5))
+    yield url
+    process.terminate()
+    process.join()
+
+
+@pytest.fixture
+def local_site():
+    """
+    Serves aiohttp handlers on free local ports from a background thread, so crawlers can run as usual.
+    `local_site(handler)` returns the URL of a site answering all GET requests with the handler.
+    """
+    from aiohttp import web
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    runners = []
+
+    async def start(handler):
+        app = web.Application()
+        app.router.add_get('/{path:.*}', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        runners.append(runner)
+        port = free_port()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        return f'http://127.0.0.1:{port}/'
+
+    yield lambda handler: asyncio.run_coroutine_threadsafe(start(handler), loop).result()
+    for runner in runners:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def write_project(folder, name, start_url, select: str = None, transform: str = None, settings: dict = None):
+    """ Writes a project module defining `crawler`, `select` and `transform` are given as source code """
+    args = [repr(start_url)]
+    for key, value in (('select', select), ('transform', transform), ('settings', settings)):
+        if value is not None:
+            args.append(f'{key}={value if isinstance(value, str) else repr(value)}')
+    path = os.path.join(folder, f'{name}.py')
+    with open(path, 'w') as file:
+        file.write(f'from microwler import Microwler, scrape\ncrawler = Microwler({", ".join(args)})\n')
+    return path
 
 
 @pytest.mark.asyncio
@@ -66,3 +138,728 @@ def test_advanced():
     )
     crawler.run(verbose=True, sort_urls=True)
 
+
+def test_exporters_write_batches(tmp_path):
+    settings = Settings({'export_to': str(tmp_path), 'export_compression': 'gzip'})
+    pages = [Page(f'https://example.com/{i}', 200, 1, []) for i in range(5)]
+    for exporter_cls in (JSONExporter, JSONLinesExporter, CSVExporter):
+        exporter = exporter_cls('example.com', None, settings)
+        exporter.open()
+        exporter.write_batch(pages[:2])
+        exporter.write_batch(pages[2:])
+        exporter.close()
+
+    files = {name.split('.')[-2]: os.path.join(tmp_path, name) for name in os.listdir(tmp_path)}
+    with gzip.open(files['json'], 'rt') as file:
+        assert [page['url'] for page in json.load(file)] == [page.url for page in pages]
+    with gzip.open(files['jsonl'], 'rt') as file:
+        assert len(file.read().splitlines()) == 5
+    with gzip.open(files['csv'], 'rt') as file:
+        assert file.readline().startswith('URL;DISCOVERED')
+
+
+class TSVExporter(FileExporter):
+    """ A custom exporter which only implements `convert()` """
+    extension = 'tsv'
+
+    def convert(self):
+        return ''.join(f'{row["url"]}\t{row["depth"]}\n' for row in self.data)
+
+
+class BrokenExporter(JSONExporter):
+    def serialize(self, rows: list, first: bool):
+        if not first:
+            raise ValueError('broken')
+        return super().serialize(rows, first)
+
+
+def test_custom_exporters(fake_site, tmp_path):
+    exporters = [TSVExporter, BrokenExporter]
+    settings = {'export_to': str(tmp_path), 'export_batch_size': 10, 'export_compression': 'gzip', 'exporters': exporters}
+    crawler = Microwler(fake_site, settings=settings)
+    crawler.run()
+    files = {name.split('.')[-2]: os.path.join(tmp_path, name) for name in os.listdir(tmp_path)}
+    with gzip.open(files['tsv'], 'rt') as file:
+        assert len(file.read().splitlines()) == 50
+    # the failing exporter is closed with the batch written before
+    with gzip.open(files['json'], 'rt') as file:
+        assert len(json.load(file)) == 10
+
+
+def test_parquet_exporter(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    settings = Settings({'export_to': str(tmp_path)})
+    pages = [Page(f'https://example.com/{i}', 200, i % 2, []) for i in range(5)]
+    for page in pages:
+        page.data = {'title': page.url}
+    exporter = ParquetExporter('example.com', None, settings)
+    exporter.open()
+    exporter.write_batch(pages[:3])
+    exporter.write_batch(pages[3:])
+    exporter.close()
+
+    file = pq.ParquetFile(exporter.path)
+    assert file.metadata.num_row_groups == 2
+    table = file.read()
+    assert table.column('data.title').to_pylist() == [page.url for page in pages]
+    assert table.column('depth').to_pylist() == [0, 1, 0, 1, 0]
+
+    # selectors return a string for one match and a list for several, fields may be missing in the first batch
+    batches = [
+        [Page('https://example.com/a', 200, 0, []), Page('https://example.com/b', 200, 1, [])],
+        [Page('https://example.com/c', 200, 1, ['https://example.com/a'])],
+        [Page('https://example.com/d', 200, 1, [])],
+    ]
+    batches[0][0].data = {'h1': 'A', 'extra': None}
+    batches[0][1].data = {'h1': None, 'tags': ['x', 'y'], 'extra': None}
+    batches[1][0].data = {'h1': ['A', 'B'], 'tags': 'z', 'extra': 3}
+    batches[2][0].data = {'h1': 1, 'tags': [1, 'w'], 'extra': ['p', 'q']}
+    exporter = ParquetExporter('example.org', None, settings)
+    exporter.open()
+    for batch in batches:
+        exporter.write_batch(batch)
+    exporter.close()
+    table = pq.read_table(exporter.path)
+    assert table.column('data.h1').to_pylist() == ['A', None, '["A", "B"]', '1']
+    assert table.column('data.tags').to_pylist() == [None, ['x', 'y'], ['z'], ['1', 'w']]
+    assert table.column('data.extra').to_pylist() == [None, None, '3', '["p", "q"]']
+    assert table.column('links').to_pylist() == [[], [], ['https://example.com/a'], []]
+
+
+
+def test_arrow_exporter(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    settings = Settings({'export_to': str(tmp_path)})
+    batches = [
+        [Page('https://example.com/a', 200, 0, []), Page('https://example.com/b', 200, 1, [])],
+        [Page('https://example.com/c', 200, 1, [])],
+        [Page('https://example.com/d', 404, 2, [])],
+    ]
+    batches[0][0].data = {'count': 1, 'meta': {'title': 'A'}}
+    batches[0][1].data = {'count': 2, 'meta': None}
+    batches[1][0].data = {'count': 2.5, 'meta': {'title': 'C', 'keywords': 'x'}, 'price': 9}
+    batches[2][0].data = {'count': 'many', 'meta': None, 'price': None}
+    exporter = ArrowExporter('example.com', None, settings)
+    exporter.open()
+    for batch in batches:
+        exporter.write_batch(batch)
+    exporter.close()
+
+    with pa.ipc.open_file(exporter.path) as reader:
+        table = reader.read_all()
+    # later batches widen columns and add fields, earlier rows are kept and backfilled with nulls
+    assert table.column('data.count').to_pylist() == ['1', '2', '2.5', 'many']
+    assert [json.loads(meta) if meta else meta for meta in table.column('data.meta').to_pylist()] == [
+        {'title': 'A'}, None, {'title': 'C', 'keywords': 'x'}, None
+    ]
+    assert table.column('data.price').to_pylist() == [None, None, 9, None]
+    assert table.column('status_code').to_pylist() == [200, 200, 200, 404]
+    assert table.column('depth').to_pylist() == [0, 1, 1, 2]
+    assert not [name for name in os.listdir(tmp_path) if '.part' in name]
+
+def test_frontier_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    checkpoint = FrontierCheckpoint('example.com', interval=3)
+    for url, depth in [('https://example.com/', 0), ('https://example.com/a', 1), ('https://example.com/b', 1)]:
+        checkpoint.seen(url)
+        checkpoint.queued(url, depth)
+    checkpoint.done('https://example.com/')
+    checkpoint.flush()
+
+    seen, pending = FrontierCheckpoint('example.com').load()
+    assert len(seen) == 3
+    assert sorted(pending) == [('https://example.com/a', 1), ('https://example.com/b', 1)]
+
+
+@pytest.mark.parametrize('kind', ['exact', 'hashed', 'bloom'])
+def test_visited_sets(kind):
+    visited = make_url_set(kind, capacity=100, error_rate=0.001)
+    visited.update(f'https://example.com/{i}' for i in range(1000))
+    assert len(visited) >= 995
+    assert all(f'https://example.com/{i}' in visited for i in range(1000))
+    assert sum(f'https://example.org/{i}' in visited for i in range(1000)) <= 5
+
+
+def test_politeness_helpers():
+    assert parse_retry_after('120') == 120
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert parse_retry_after('soon') is None
+
+    limiter = AdaptiveLimiter(maximum=8, latency_target=1.0)
+    limiter._active = 1
+    limiter.release(latency=0.1, failed=True)
+    assert limiter.limit == 4
+    limiter._active = 1
+    limiter.release(latency=0.1, failed=False)
+    assert limiter.limit == 4.25
+
+
+def test_offline_crawl(fake_site):
+    crawler = Microwler(fake_site, select={'title': scrape.title}, settings={'max_concurrency': 5})
+    crawler.run()
+    assert len(crawler.results) == 50
+    assert not crawler.errors
+    assert {page['data']['title'] for page in crawler.results} == {f'Page {i}' for i in range(50)}
+
+    crawler = Microwler(fake_site, settings={'max_depth': 1})
+    crawler.run()
+    assert sorted(page['depth'] for page in crawler.results) == [0, 1, 1, 1]
+
+
+@pytest.mark.parametrize('pool', ['thread', 'process'])
+def test_parser_pool(fake_site, pool):
+    settings = {'max_concurrency': 5, 'parser_pool': pool, 'parser_workers': 2}
+    crawler = Microwler(fake_site, select={'title': scrape.title}, settings=settings)
+    crawler.run()
+    assert len(crawler.results) == 50 and not crawler.errors
+    assert {page['data']['title'] for page in crawler.results} == {f'Page {i}' for i in range(50)}
+
+
+def test_streaming(fake_site, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    select = {'title': scrape.title}
+    crawler = Microwler(fake_site, select=select, settings={'max_concurrency': 5})
+    crawler.run(sort_urls=True)
+    streamed = Microwler(fake_site, select=select, settings={'max_concurrency': 5, 'streaming': True, 'caching': True})
+    streamed.run(sort_urls=True)
+
+    # pages are scraped and cached while crawling, their HTML is dropped right away
+    assert streamed.results == crawler.results
+    assert all(page.html is None for page in streamed._results.values())
+    assert streamed.metrics.histograms['scrape'].count == 50 and len(streamed.cache) == 50
+    assert all('html' not in entry and entry['data'] for entry in streamed.cache)
+
+
+def test_revalidate(local_site, tmp_path, monkeypatch):
+    from aiohttp import web
+
+    monkeypatch.chdir(tmp_path)
+    requests = []
+
+    async def handle(request):
+        etag = f'"{request.path}"'
+        requests.append((request.path, request.headers.get('If-None-Match')))
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        links = '<a href="/a">a</a>' if request.path == '/' else ''
+        html = f'<html><title>{request.path}</title><body>{links}</body></html>'
+        return web.Response(text=html, content_type='text/html', headers={'ETag': etag})
+
+    url = local_site(handle)
+    settings = {'revalidate': True, 'max_retries': 0}
+    first = Microwler(url, select={'title': '//title/text()'}, settings=settings)
+    first.run(sort_urls=True)
+    assert first._cache[url]['validators'] == {'etag': '"/"'}
+
+    second = Microwler(url, select={'title': '//title/text()'}, settings=settings)
+    written = []
+    monkeypatch.setattr(second._cache, 'set_many', lambda entries, expire=None: written.extend(entries))
+    second.run(sort_urls=True)
+    # the second run sends the validators and reuses the cached pages, including their links
+    assert requests[2:] == [('/', '"/"'), ('/a', '"/a"')]
+    assert second.results == first.results and second.results[0]['links'] == [f'{url}a']
+    assert written == []
+
+
+def test_content_fingerprints(local_site, tmp_path, monkeypatch):
+    from aiohttp import web
+
+    monkeypatch.chdir(tmp_path)
+    # /copy serves the same content as /a, /b changes between runs
+    site = {'/': '<a href="/a">a</a><a href="/copy">c</a><a href="/b">b</a>', '/a': 'same', '/copy': 'same', '/b': 'v1'}
+
+    async def handle(request):
+        return web.Response(text=f'<html><body>{site[request.path]}</body></html>', content_type='text/html')
+
+    url = local_site(handle)
+    first = Microwler(url, select={'body': '//body/text()'}, settings={'dedup_content': True, 'caching': True})
+    first.run()
+    assert first.duplicates == {f'{url}copy': f'{url}a'}
+    assert sorted(page['url'] for page in first.results) == [url, f'{url}a', f'{url}b']
+
+    site['/b'] = 'v2'
+    settings = {'skip_unchanged': True, 'export_changed_only': True, 'exporters': [JSONLinesExporter],
+                'export_to': str(tmp_path / 'exports')}
+    second = Microwler(url, select={'body': '//body/text()'}, settings=settings)
+    written = []
+    monkeypatch.setattr(second._cache, 'set_many', lambda entries, expire=None: written.extend(entries))
+    second.run()
+    # unchanged pages are taken from the cache without scraping, caching or exporting them
+    changed = [f'{url}b', f'{url}copy']
+    assert second._unchanged == {url, f'{url}a'} and second.metrics.histograms['scrape'].count == 2
+    assert sorted(url for url, _ in written) == changed
+    assert [page['data'] for page in second.results if page['url'] == f'{url}a'] == [{'body': 'same'}]
+    export = os.path.join(tmp_path, 'exports', os.listdir(tmp_path / 'exports')[0])
+    with open(export) as file:
+        assert sorted(json.loads(line)['url'] for line in file) == changed
+
+
+
+@pytest.mark.parametrize('store_links', ['ids', None])
+def test_store_links_unchanged(fake_site, tmp_path, monkeypatch, store_links):
+    monkeypatch.chdir(tmp_path)
+    settings = {'max_concurrency': 5, 'store_links': store_links, 'skip_unchanged': True}
+    first = Microwler(fake_site, settings=settings)
+    first.run(sort_urls=True)
+    second = Microwler(fake_site, settings=settings)
+    second.run(sort_urls=True)
+    # the links of unchanged pages are taken from the body, as the cached ones have been compacted
+    assert len(second._unchanged) == len(second.results) == 50 and not second.errors
+    assert second.results == first.results
+    with pytest.raises(ValueError):
+        Microwler(fake_site, settings={'store_links': store_links, 'revalidate': True})
+
+
+def test_retries(local_site):
+    from aiohttp import web
+
+    requests = {}
+
+    async def handle(request):
+        times = requests.setdefault(request.path, [])
+        times.append(time.monotonic())
+        if request.path == '/':
+            html = '<html><body><a href="/flaky">f</a><a href="/down">d</a></body></html>'
+            return web.Response(text=html, content_type='text/html')
+        if request.path == '/flaky' and len(times) == 1:
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        if request.path == '/down':
+            return web.Response(status=503)
+        return web.Response(text='<html><body>ok</body></html>', content_type='text/html')
+
+    url = local_site(handle)
+    crawler = Microwler(url, settings={'max_retries': 2, 'backoff_base': 0.2})
+    crawler.run()
+    # Retry-After is honoured, other retries back off and the last status is recorded once they run out
+    flaky, down = requests['/flaky'], requests['/down']
+    assert len(flaky) == 2 and flaky[1] - flaky[0] >= 0.9
+    assert len(down) == 3 and all(b - a >= 0.1 for a, b in zip(down, down[1:]))
+    assert crawler.errors == {f'{url}down': 'HTTP 503'}
+    assert sorted(page['url'] for page in crawler.results) == [url, f'{url}flaky']
+    assert crawler.metrics.counters['retries'] == 3
+
+def test_shortest_depth(local_site):
+    from aiohttp import web
+
+    # / -> slow -> x and / -> fast -> f2 -> x -> y, x must get depth 2 although the long path finds it first
+    site = {'/': ['slow', 'fast'], '/slow': ['x'], '/fast': ['f2'], '/f2': ['x'], '/x': ['y'], '/y': []}
+
+    async def handle(request):
+        if request.path == '/slow':
+            await asyncio.sleep(0.5)
+        links = ''.join(f'<a href="/{link}">{link}</a>' for link in site[request.path])
+        return web.Response(text=f'<html><body>{links}</body></html>', content_type='text/html')
+
+    url = local_site(handle)
+    crawler = Microwler(url, settings={'max_depth': 3})
+    crawler.run()
+    depths = {page['url'][len(url):]: page['depth'] for page in crawler.results}
+    assert depths == {'': 0, 'slow': 1, 'fast': 1, 'f2': 2, 'x': 2, 'y': 3}
+
+
+def test_page_serialization():
+    html = '<html><head><title>Caf\u00e9</title></head><body>' + '<p>Lorem ipsum</p>' * 100 + '</body></html>'
+    page = Page('http://example.org/', 200, 1, ['http://example.org/a'], html, compress=True)
+    assert not hasattr(page, '__dict__')
+    assert len(page._body) < len(html) and page.html == html
+    assert list(page.to_dict()) == ['url', 'discovered', 'status_code', 'depth', 'links', 'html', 'data']
+    assert Page.from_dict(page.to_dict()).to_dict() == page.to_dict()
+    assert Page('http://example.org/', 200, 1, html=html.encode('latin-1'), encoding='latin-1').html == html
+    page.scrape({'title': '//title/text()'})
+    assert page.html is None and 'html' not in page.to_dict() and page.data == {'title': 'Caf\u00e9'}
+    assert 'html' not in Page.from_dict(page.to_dict()).to_dict()
+
+
+def test_compiled_selectors():
+    html = '<html><head><base href="/docs/"><title> Docs </title></head><body>' \
+           '<h1>A</h1><h1>B</h1><a href="intro"> </a><a href="http://other.org/">x</a></body></html>'
+    selectors = {
+        'title': '//title/text()',
+        'headings': '//h1/text()',
+        'first': '//h1',
+        'count': 'count(//h1)',
+        'has_title': 'boolean(//title)',
+        'custom': lambda dom: dom.css('h1::text').getall(),
+    }
+    expected = Page('http://example.org/', 200, 0, html=html).scrape(selectors).data
+    assert expected == {
+        'title': ' Docs ', 'headings': ['A', 'B'], 'first': ['<h1>A</h1>', '<h1>B</h1>'],
+        'count': '2.0', 'has_title': '1', 'custom': ['A', 'B'],
+    }
+    dom = utils.parse_html(html)
+    page = Page('http://example.org/', 200, 0, html=html).scrape(utils.compile_selectors(selectors), dom=dom)
+    assert page.data == expected
+    assert utils.extract_links(dom, 'http://example.org/', utils.compile_xpath('//a/@href')) == \
+        ['http://example.org/docs/intro']
+    # links are resolved against <base>, but always scoped to the crawled website
+    html = '<html><head><base href="https://cdn.other.com/"></head><body><a href="x">x</a>' \
+           '<a href="http://example.org/y">y</a></body></html>'
+    assert utils.extract_links(html, 'http://example.org/', '//a/@href') == ['http://example.org/y']
+    html = '<html><head><base href="/docs/"></head><body><a href="a">a</a><a href="/b">b</a></body></html>'
+    assert sorted(utils.extract_links(html, 'http://example.org/', '//a/@href')) == \
+        ['http://example.org/b', 'http://example.org/docs/a']
+
+
+def test_url_filter():
+    url_filter = URLFilter(include=[r'/blog/'], exclude=[r'/blog/drafts/'], strip_params=['utm_*', 'sid'])
+    assert url_filter.normalize('http://example.org/blog/a?utm_source=x&b=2&a=1&SID=3#top') == \
+        'http://example.org/blog/a?a=1&b=2'
+    assert url_filter.normalize('http://example.org?utm_medium=y') == 'http://example.org/'
+    assert url_filter.filter([
+        'http://example.org/blog/a', 'http://example.org/blog/drafts/b', 'http://example.org/about',
+        'http://example.org/blog/cover.JPG', 'http://example.org/blog/file.pdf?download=1', 'http://example.org/blog/maps',
+    ]) == ['http://example.org/blog/a', 'http://example.org/blog/maps']
+    url_filter.accept('http://example.org/blog/a')
+    assert url_filter.cache_info()['accept'].hits == 1
+    # the default filter only checks file extensions
+    assert utils.DEFAULT_URL_FILTER.filter(['http://example.org/a.css', 'http://example.org/a?utm_source=x']) == \
+        ['http://example.org/a?utm_source=x']
+
+
+def test_scrape_pool(fake_site, tmp_path):
+    settings = {'max_concurrency': 5, 'scrape_pool': True, 'scrape_workers': 2, 'scrape_chunk_size': 8}
+    crawler = Microwler(fake_site, select={'title': scrape.title, 'h1': '//h1/text()'}, settings=settings)
+    crawler.run()
+    assert all(page['data'] == {'title': f'Page {page["url"].rsplit("/", 1)[-1] or 0}',
+                                'h1': f'Page {page["url"].rsplit("/", 1)[-1] or 0}'} for page in crawler.results)
+    assert crawler.metrics.histograms['scrape'].count == 50
+
+    # lambdas can't be pickled, so workers import them from the project module
+    write_project(tmp_path, 'pooled', fake_site, select='{"title": lambda dom: dom.css("title::text").get()}',
+                  transform='lambda data: {"title": data["title"].upper()}', settings=settings)
+    project = utils.load_project('pooled', str(tmp_path))
+    project.crawler.run()
+    assert {page['data']['title'] for page in project.crawler.results} == {f'PAGE {i}' for i in range(50)}
+
+
+def test_fetch_limits(local_site):
+    from aiohttp import web
+
+    async def handle(request):
+        if request.path == '/report':
+            return web.Response(body=b'%PDF-1.4' + bytes(1000), content_type='application/pdf')
+        if request.path == '/huge':
+            return web.Response(text='<html>' + 'x' * 5000 + '</html>', content_type='text/html')
+        if request.path == '/latin':
+            body = '<html><head><meta charset="iso-8859-1"><title>Caf\u00e9</title></head></html>'.encode('latin-1')
+            return web.Response(body=body, content_type='text/html')
+        links = ''.join(f'<a href="/{link}">{link}</a>' for link in ('report', 'huge', 'latin'))
+        return web.Response(text=f'<html><body>{links}</body></html>', content_type='text/html')
+
+    settings = {'max_body_size': 2000, 'max_retries': 0}
+    crawler = Microwler(local_site(handle), select={'title': '//title/text()'}, settings=settings)
+    crawler.run()
+    assert sorted(page['url'].rsplit('/', 1)[-1] for page in crawler.results) == ['', 'latin']
+    assert [page['data']['title'] for page in crawler.results if page['url'].endswith('latin')] == ['Caf\u00e9']
+    assert crawler.metrics.counters['skipped'] == 2 and not crawler.errors
+
+    assert utils.decode_body('\u00e9'.encode('utf-8')) == ('\u00e9', 'utf-8')
+    assert utils.decode_body(b'\xe9') == ('\u00e9', 'cp1252')
+    assert utils.decode_body('\u00e9'.encode('utf-16'))[0] == '\u00e9'
+    assert utils.decode_body(b'\xe9', 'text/html; charset="ISO-8859-15"') == ('\u00e9', 'iso8859-15')
+
+
+def test_discovery(local_site, tmp_path, monkeypatch):
+    from aiohttp import web
+
+    monkeypatch.chdir(tmp_path)
+    requests = []
+    urlset = '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{}</urlset>'
+    entry = '<url><loc>{}</loc><lastmod>{}</lastmod></url>'
+
+    async def handle(request):
+        requests.append(request.path)
+        base = f'http://{request.host}'
+        if request.path == '/robots.txt':
+            text = f'User-agent: *\nDisallow: /private\nSitemap: {base}/sitemap_index.xml\n'
+            return web.Response(text=text, content_type='text/plain')
+        if request.path == '/sitemap_index.xml':
+            body = ''.join(f'<sitemap><loc>{base}/{name}</loc></sitemap>' for name in ('one.xml.gz', 'two.xml'))
+            return web.Response(text=f'<sitemapindex>{body}</sitemapindex>', content_type='application/xml')
+        if request.path == '/one.xml.gz':
+            body = urlset.format(entry.format(f'{base}/old', '2000-01-01') + entry.format(f'{base}/new', '2999-01-01'))
+            return web.Response(body=gzip.compress(body.encode()), content_type='application/x-gzip')
+        if request.path == '/two.xml':
+            body = urlset.format(entry.format(f'{base}/private', '2000-01-01') + entry.format('http://other/', ''))
+            return web.Response(text=body, content_type='application/xml')
+        return web.Response(text=f'<html><title>{request.path}</title></html>', content_type='text/html')
+
+    url = local_site(handle)
+    settings = {'sitemaps': True, 'respect_robots': True, 'max_depth': 1, 'max_retries': 0}
+    first = Microwler(url, settings={**settings, 'caching': True})
+    first.run()
+    second = Microwler(url, settings={**settings, 'delta_crawl': True})
+    second.run()
+    # orphan pages are found through the (gzipped) sitemaps, disallowed and foreign URLs are dropped
+    assert sorted(page['url'] for page in first.results) == [url, f'{url}new', f'{url}old']
+    assert first.metrics.counters['disallowed'] == 1 and '/private' not in requests
+    rules = discovery.parse_robots('User-agent: *\nCrawl-delay: 2\n')
+    first._scheduler.crawl_delay(first.start_url, rules.crawl_delay(discovery.ROBOTS_AGENT))
+    assert first._scheduler.host(first.start_url).bucket.rate == 0.5
+    # only the page modified after it was cached is crawled again, robots.txt is cached
+    assert [page['url'] for page in second.results] == [f'{url}new']
+    assert requests.count('/robots.txt') == 1
+    # sitemap URLs are queued at depth 1, so they are not read with max_depth 0
+    read = requests.count('/sitemap_index.xml')
+    third = Microwler(url, settings={**settings, 'max_depth': 0})
+    third.run()
+    assert [page['url'] for page in third.results] == [url] and requests.count('/sitemap_index.xml') == read
+
+
+def test_shared_client(fake_site):
+    # other tests crawled this site already, a different connection setting gives a separate pool
+    settings = {'max_concurrency': 5, 'keepalive_timeout': 14.0}
+    first = Microwler(fake_site, settings=settings)
+    first.run()
+    second = Microwler(fake_site, settings=settings)
+    second.run()
+    assert len(second.results) == 50
+    # connections of the first run are reused
+    assert first.metrics.histograms['connect'].count > 0
+    assert second.metrics.histograms['connect'].count == 0
+
+
+def test_orchestrator(fake_site, tmp_path):
+    for name, depth in (('one', 1), ('two', 2), ('all', 10)):
+        write_project(tmp_path, name, fake_site, settings={'max_depth': depth, 'max_concurrency': 5})
+    (tmp_path / 'broken.py').write_text('raise RuntimeError("broken project")\n')
+
+    report = Orchestrator(project_folder=str(tmp_path), max_requests=4, max_projects=2).run()
+    assert {name: stats['pages'] for name, stats in report['projects'].items()} == \
+        {'one': 4, 'two': 13, 'all': 50, 'broken': 0}
+    assert report['pages'] == 67 and report['failed'] == ['broken']
+    assert report['metrics']['counters']['pages'] == 67
+
+    report = crawl_all(['one', 'two', 'all'], project_folder=str(tmp_path), workers=2, max_requests=4)
+    assert report['pages'] == 67 and not report['failed']
+
+
+def test_fair_budget():
+    async def scenario():
+        budget, order = FairBudget(2), []
+
+        async def request(host):
+            await budget.acquire(host)
+            order.append(host)
+            await asyncio.sleep(0.01)
+            budget.release(host)
+
+        await asyncio.gather(*(request('big') for _ in range(6)), request('small'))
+        return order
+
+    order = asyncio.run(scenario())
+    # the small host is served as soon as the first slot frees up
+    assert order.index('small') == 2
+
+
+def test_distributed_crawl(fake_site, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = os.path.join(tmp_path, 'projects')
+    os.makedirs(folder)
+    write_project(folder, 'sharded', fake_site, select='{"title": scrape.title}',
+                  settings={'max_concurrency': 5, 'caching': True})
+    crawler = crawl_distributed('sharded', workers=3, project_folder=folder)
+    assert len(crawler.results) == 50
+    assert {page['data']['title'] for page in crawler.results} == {f'Page {i}' for i in range(50)}
+    assert len(crawler.cache) == 50
+
+    backend = make_backend(None, crawler._domain)
+    assert backend.remaining() == 0 and len(list(backend.results())) == 50
+    backend.add([(crawler.start_url, 0), ('http://other/', 1)], 3)
+    assert backend.remaining() == 1 and [url for url, _ in backend.pop(shard_of('http://other/', 3), 5)] == ['http://other/']
+
+
+def test_distributed_worker(fake_site, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = os.path.join(tmp_path, 'projects')
+    os.makedirs(folder)
+    write_project(folder, 'single', fake_site, select='{"title": scrape.title}', settings={'max_concurrency': 5})
+    saved = []
+    save_results = SQLiteBackend.save_results
+
+    def record(backend, entries):
+        saved.append((len(entries), threading.current_thread() is threading.main_thread()))
+        save_results(backend, entries)
+
+    monkeypatch.setattr(SQLiteBackend, 'save_results', record)
+    reset('single', project_folder=folder)
+    assert run_worker('single', 0, 1, project_folder=folder) == 50
+    # results are stored in batches while crawling, off the event loop
+    batches = [count for count, main in saved if count]
+    assert sum(batches) == 50 and len(batches) > 1
+    assert not any(main for _, main in saved)
+
+
+def _fill_cache(directory, worker):
+    cache = PageCache(directory)
+    for batch in range(5):
+        cache.set_many([(f'http://example.org/{worker}/{batch}/{i}', {'worker': worker}) for i in range(20)])
+    cache.close()
+
+
+def test_page_cache(tmp_path):
+    from concurrent.futures import ProcessPoolExecutor
+    from diskcache import Index
+
+    directory = str(tmp_path / 'cache')
+    Index(directory)['http://example.org/legacy'] = {'url': 'http://example.org/legacy'}
+    cache = PageCache(directory, ttl=60)
+    entry = {'url': 'http://example.org/', 'html': '<p>lorem ipsum</p>' * 1000}
+    cache.set_many([('http://example.org/', entry), ('http://example.org/short', entry)])
+    cache.set_many([('http://example.org/gone', entry)], expire=0.01)
+    time.sleep(0.02)
+    assert cache['http://example.org/'] == entry and 'http://example.org/gone' not in cache
+    assert cache.get('http://example.org/legacy') == {'url': 'http://example.org/legacy'}
+    assert len(list(cache.values())) == 3 and cache.volume() < 100000
+    with pytest.raises(KeyError):
+        cache['http://example.org/missing']
+
+    # several processes may write to the same cache
+    with ProcessPoolExecutor(max_workers=3) as executor:
+        list(executor.map(_fill_cache, [directory] * 3, range(3)))
+    assert len(cache) == 3 + 3 * 5 * 20
+
+    # entries of earlier versions are indexed by the first query
+    entries, cursor = cache.query(limit=60, prefix='http://example.org/1/')
+    assert len(entries) == 60 and {entry['worker'] for entry in entries} == {1}
+    entries, cursor = cache.query(limit=60, cursor=cursor, prefix='http://example.org/1/')
+    assert len(entries) == 40 and cursor is None
+    cache.set_many([('http://example.org/a', {'status_code': 404, 'depth': 2, 'discovered': '2021-01-01'})])
+    assert cache.query(status_code=404, discovered_until='2021-12-31')[0] == [
+        {'status_code': 404, 'depth': 2, 'discovered': '2021-01-01'}
+    ]
+    assert cache.query(depth=2, discovered_since='2022-01-01') == ([], None)
+    assert [entry['url'] for entry in cache.query(prefix='http://example.org/l')[0]] == ['http://example.org/legacy']
+    cache.clear()
+    assert cache.query() == ([], None)
+    with pytest.raises(ValueError):
+        PageCache(directory, compression='lzma')
+
+
+
+def test_zstd_cache(tmp_path):
+    pytest.importorskip('zstandard')
+    from microwler.cache import DICTIONARY_KEY
+
+    def entries(prefix, count):
+        return [(f'http://example.org/{prefix}/{i}', {'url': f'{prefix}/{i}', 'html': f'<p>{prefix} {i}</p>' * 50})
+                for i in range(count)]
+
+    directory = str(tmp_path / 'cache')
+    cache = PageCache(directory, size_limit=2 ** 19, compression='zstd')
+    cache.set_many(entries('first', 200))
+    first = cache._dictionary_store[DICTIONARY_KEY]
+    # another process may have trained a different dictionary, entries are decoded with the one they name
+    cache._dictionary_store.delete(DICTIONARY_KEY)
+    cache._dictionary = None
+    cache.set_many(entries('second', 200))
+    assert cache._dictionary_store[DICTIONARY_KEY] != first
+    other = PageCache(directory, size_limit=2 ** 19, compression='zstd')
+    assert other['http://example.org/first/0']['url'] == 'first/0'
+    assert other['http://example.org/second/0']['url'] == 'second/0'
+    # filling the cache evicts entries, but never the dictionaries
+    for batch in range(20):
+        cache.set_many(entries(f'fill{batch}', 200))
+    assert 0 < len(cache) < 4400 and len(list(other.values())) == len(other)
+    assert first in cache._dictionary_store
+    cache.close()
+    other.close()
+
+def test_cache_across_threads(fake_site, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def crawl():
+        # run_async writes the cache in an executor thread, queries come from the event loop
+        crawler = Microwler(fake_site, settings={'caching': True, 'max_concurrency': 5})
+        await crawler.run_async(asyncio.get_event_loop())
+        await client.close_sessions()
+        return crawler.query_cache(limit=10)
+
+    entries, cursor = asyncio.run(crawl())
+    assert len(entries) == 10 and cursor is not None
+
+
+def test_web_jobs(fake_site, tmp_path, monkeypatch):
+    from microwler.web import backend
+
+    write_project(tmp_path, 'site', fake_site, select='{"title": scrape.title}', settings={'max_concurrency': 5})
+    monkeypatch.setattr(backend, 'PROJECT_FOLDER', str(tmp_path))
+    monkeypatch.setattr(backend, '_job_slots', None)
+    monkeypatch.chdir(tmp_path)
+
+    async def scenario():
+        client = backend.app.test_client()
+        response = await client.post('/jobs/site')
+        assert response.status_code == 202
+        job_id = (await response.get_json())['id']
+        assert (await client.post('/jobs/missing')).status_code == 404
+        for _ in range(200):
+            status = await (await client.get(f'/jobs/{job_id}')).get_json()
+            if status['state'] in ('finished', 'failed'):
+                break
+            await asyncio.sleep(0.05)
+        assert status['state'] == 'finished' and status['pages'] == 50
+        response = await client.get(f'/jobs/{job_id}/results')
+        assert response.content_type == 'application/x-ndjson'
+        pages = [json.loads(line) for line in (await response.get_data(as_text=True)).splitlines()]
+
+        # cached data is served in pages
+        cached, cursor = [], None
+        for _ in range(4):
+            query = f'?limit=20&cursor={cursor}' if cursor else '?limit=20'
+            result = await (await client.get(f'/data/site{query}')).get_json()
+            cached += result['data']
+            cursor = result['cursor']
+            if cursor is None:
+                break
+        assert len(cached) == 50 and cursor is None
+        assert [page['url'] for page in cached] == sorted(page['url'] for page in pages)
+        assert (await (await client.get('/data/site?status=404')).get_json()) == {'data': [], 'cursor': None}
+        assert (await client.get('/data/site?limit=x')).status_code == 400
+
+        # the results of finished jobs are dropped after a while
+        monkeypatch.setattr(backend, 'RESULTS_TTL', 0)
+        assert (await client.get(f'/jobs/{job_id}/results')).status_code == 410
+        assert (await (await client.get(f'/jobs/{job_id}')).get_json())['pages'] == 50
+        await backend.shutdown()
+        return pages
+
+    pages = asyncio.run(scenario())
+    assert {page['data']['title'] for page in pages} == {f'Page {i}' for i in range(50)}
+
+
+def test_lazy_imports():
+    # the CLI starts without the crawler's, the web service's or any other heavy dependencies
+    seconds, loaded = measure_imports(['microwler.cli.cmd', 'microwler.cli.template'])
+    assert loaded == []
+    seconds, loaded = measure_imports(['microwler.crawler'])
+    assert 'quart' not in loaded and 'parsel' not in loaded and 'random_user_agent' not in loaded
+    assert 'Chrome' in utils.UAFactory.get_random_user_agent()
+
+
+def test_metrics():
+    metrics = Metrics()
+    for seconds in (0.004, 0.004, 0.2):
+        metrics.observe('download', seconds)
+    metrics.inc('pages', 3)
+    metrics.gauge('in_flight', delta=2)
+
+    snapshot = metrics.snapshot()
+    assert snapshot['stages']['download']['count'] == 3
+    assert snapshot['stages']['download']['p50'] == 0.005
+    assert snapshot['counters']['pages'] == 3
+    text = metrics.to_prometheus(labels={'project': 'test'})
+    assert 'microwler_stage_seconds_bucket{project="test",stage="download",le="+Inf"} 3' in text
+    assert 'microwler_in_flight{project="test"} 2' in text
+
+    # each family is written once, with the samples of all projects
+    other = Metrics()
+    other.observe('download', 0.1)
+    other.inc('pages')
+    text = to_prometheus([({'project': 'a'}, metrics), ({'project': 'b'}, other)])
+    lines = text.splitlines()
+    assert lines.count('# TYPE microwler_stage_seconds histogram') == 1
+    assert lines.count('# TYPE microwler_pages_total counter') == 1
+    start = lines.index('# TYPE microwler_pages_total counter')
+    assert lines[start + 1:start + 3] == ['microwler_pages_total{project="a"} 3', 'microwler_pages_total{project="b"} 1']
+    assert 'microwler_stage_seconds_count{project="b",stage="download"} 1' in lines